@@ -0,0 +1,60 @@
+""" Import time budget for short commands such as `bookshelf ls`.
+
+Imports src.bookshelf in fresh interpreters with -X importtime, reports the median cumulative
+import time as JSON and fails when it is over budget or when a heavy dependency got imported.
+
+    python -m benchmarks.import_time [--budget-ms=100] [--runs=5]
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+MODULE = 'src.bookshelf'
+
+# Only the commands needing these may import them.
+HEAVY_MODULES = ['requests', 'git', 'colors']
+
+
+def import_time_us():
+    """ Cumulative import time of MODULE in microseconds, measured in a fresh interpreter. """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {MODULE}'],
+                            cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [field.strip() for field in line.removeprefix('import time:').split('|')]
+        if len(fields) == 3 and fields[2] == MODULE:
+            return int(fields[1])
+    raise RuntimeError(f"{MODULE} not found in -X importtime output")
+
+
+def heavy_imports():
+    probe = f"import sys, json, {MODULE}; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    result = subprocess.run([sys.executable, '-c', probe], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=100.0)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    import_ms = statistics.median(import_time_us() for _ in range(args.runs)) / 1000
+    heavy = heavy_imports()
+    report = {
+        'module': MODULE,
+        'import_ms': round(import_ms, 2),
+        'budget_ms': args.budget_ms,
+        'heavy_imports': heavy,
+        'ok': import_ms <= args.budget_ms and not heavy,
+    }
+    print(json.dumps(report))
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+""" Time core bookshelf commands against a synthetic collection.
+
+Every command runs through the real CLI in a fresh interpreter, after one untimed warm up run, and is
+reported with its median wall time, peak RSS and, when strace is installed, its syscall count. The
+JSON report carries the commit it was made at so runs can be compared across commits.
+
+    python -m benchmarks.run [--cards=10000] [--depth=3] [--fanout=4] [--layout=mixed] [--history=12]
+                             [--home=DIR] [--runs=3] [--cold] [--only=ls,search] [--output=FILE]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+from . import synthetic
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+INDEX_NAME = '.bookshelf/index'
+
+
+def benchmarks(description, www_dir):
+    """ Benchmark name -> bookshelf command line. """
+    leafs = description['leaf_shelfs']
+    return {
+        'ls': ['ls', 'mtg'],
+        'ls_recursive': ['ls', 'mtg', '-r'],
+        'ls_flatten': ['ls', 'mtg', '-r', '--flatten'],
+        'ls_sort_price': ['ls', 'mtg', '-r', '--sort-by=price'],
+        'ls_price_sum': ['ls', 'mtg', '-qq', '-r', '--price-sum'],
+        'search_title': ['search', 'mtg', f"--title={description['sample_name']}"],
+        'search_cardset': ['search', 'mtg', f"--cardset={description['sample_set']}"],
+        'price_update_dry': ['price-update', 'mtg', '-r', '--dry'],
+        'generate_www': ['generate-www', 'mtg', f"--output={www_dir}"],
+        'consolidate': ['consolidate', leafs[0], leafs[-1]],
+    }
+
+
+def run_command(args, home, strace=False):
+    """ Run bookshelf once, returning wall time in seconds, peak RSS in KiB and syscall count. """
+    env = dict(os.environ, BOOKSHELF_HOME=str(home))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(REPO_ROOT), os.environ.get('PYTHONPATH')]))
+    command = [sys.executable, '-m', 'src', *args]
+    with tempfile.NamedTemporaryFile('r') as strace_output, tempfile.TemporaryFile('w+') as stderr:
+        if strace:
+            command = ['strace', '-f', '-c', '-o', strace_output.name, *command]
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=home, env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+        _pid, status, rusage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        if os.waitstatus_to_exitcode(status) != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"{' '.join(args)} failed: {stderr.read()}")
+        return wall, rusage.ru_maxrss, count_syscalls(strace_output.read()) if strace else None
+
+
+def count_syscalls(strace_summary):
+    """ Total calls from the summary line of strace -c.
+
+    Which columns there are depends on the strace version and some are left blank on the total line, so the
+    calls are read from under the calls header, the numbers being right aligned to it.
+    """
+    calls_end = None
+    for line in strace_summary.splitlines():
+        if calls_end is None and (header := line.split()) and header[0] == '%' and 'calls' in header:
+            calls_end = line.index(' calls') + len(' calls')
+        elif calls_end is not None and line.strip().endswith('total'):
+            return int(line[:calls_end].split()[-1])
+
+
+def run_benchmark(args, home, runs, cold, strace):
+    if not cold:
+        run_command(args, home)
+
+    walls, rss = [], []
+    for _ in range(runs):
+        if cold:
+            Path(home, INDEX_NAME).unlink(missing_ok=True)
+        wall, max_rss, _syscalls = run_command(args, home)
+        walls.append(wall)
+        rss.append(max_rss)
+
+    result = {
+        'command': args,
+        'wall_s': round(statistics.median(walls), 4),
+        'wall_runs_s': [round(wall, 4) for wall in walls],
+        'max_rss_kb': max(rss),
+        'syscalls': None,
+    }
+    if strace:
+        if cold:
+            Path(home, INDEX_NAME).unlink(missing_ok=True)
+        result['syscalls'] = run_command(args, home, strace=True)[2]
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    synthetic.add_arguments(parser)
+    parser.add_argument('--home', help="Generate the collection here and keep it, default is a temporary directory.")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--cold', action='store_true', help="Drop the metadata index before every run.")
+    parser.add_argument('--only', help="Comma separated benchmark names.")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout.")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix='bookshelf-bench-'))
+    try:
+        home = Path(args.home) if args.home else work_dir / 'home'
+        if not (home / 'mtg').exists():
+            description = synthetic.generate(home, args.cards, args.depth, args.fanout, args.layout, args.history,
+                                             args.bulk_extra, args.seed)
+            # Keep the description with a kept home, it is not a metadata file so bookshelf ignores it.
+            with open(home / 'benchmark.json', 'w') as f:
+                json.dump(description, f)
+        else:
+            with open(home / 'benchmark.json', 'r') as f:
+                description = json.load(f)
+
+        selected = benchmarks(description, work_dir / 'www')
+        if args.only:
+            selected = {name: selected[name] for name in args.only.split(',')}
+
+        strace = shutil.which('strace') is not None
+        report = {
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'collection': {k: v for k, v in description.items() if k not in ('home', 'shelfs', 'leaf_shelfs')},
+            'runs': args.runs,
+            'cold': args.cold,
+            'results': {},
+        }
+        for name, command in selected.items():
+            report['results'][name] = run_benchmark(command, home, args.runs, args.cold, strace)
+            print(f"{name}: {report['results'][name]['wall_s']}s", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
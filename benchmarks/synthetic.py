@@ -0,0 +1,158 @@
+""" Synthetic bookshelf home with realistic MTG metadata, plus a matching Scryfall bulk file.
+
+    python -m benchmarks.synthetic HOME [--cards=10000] [--depth=3] [--fanout=4] [--layout=mixed] [--history=12]
+"""
+import sys
+import json
+import uuid
+import random
+import itertools
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+
+METADATA_NAME = '.bookshelf.metadata'
+LAYOUTS = ['file', 'folder', 'mixed']
+
+SYLLABLES = ['ash', 'bolt', 'cinder', 'dusk', 'ember', 'frost', 'glimmer', 'hollow', 'iron', 'jade', 'kin', 'lumen',
+             'mire', 'night', 'oath', 'pyre', 'quill', 'rune', 'storm', 'thorn', 'umbra', 'vale', 'wisp', 'zeal']
+KINDS = ['Angel', 'Behemoth', 'Charm', 'Dragon', 'Elemental', 'Familiar', 'Guardian', 'Hex', 'Invocation', 'Knight',
+         'Lotus', 'Mage', 'Oracle', 'Reckoning', 'Sphinx', 'Titan', 'Wurm']
+
+
+def shelf_tree(root, depth, fanout):
+    """ Shelf paths in pre-order, root first. """
+    shelfs = [root]
+    if depth > 0:
+        for n in range(fanout):
+            shelfs.extend(shelf_tree(root / f"shelf-{depth}-{n}", depth - 1, fanout))
+    return shelfs
+
+
+def make_printings(rng, cards):
+    """ Distinct printings owned cards are drawn from, a card has a few printings in different sets. """
+    sets = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(3))
+            for _ in range(max(4, cards // 400))]
+    release = {set_code: datetime(1993, 8, 5) + timedelta(days=rng.randrange(30 * 365)) for set_code in sets}
+    printings = []
+    for n in range(max(1, cards // 4)):
+        name = f"{rng.choice(SYLLABLES).title()}{rng.choice(SYLLABLES)} {rng.choice(KINDS)}"
+        if n % 50 == 0:
+            name += f" // {rng.choice(SYLLABLES).title()} {rng.choice(KINDS)}"
+        oracle_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        for set_code in rng.sample(sets, min(len(sets), rng.randint(1, 4))):
+            eur = round(rng.lognormvariate(0, 1.5), 2)
+            printings.append({
+                'object': 'card',
+                'id': str(uuid.UUID(int=rng.getrandbits(128))),
+                'oracle_id': oracle_id,
+                'name': name,
+                'lang': 'en',
+                'released_at': release[set_code].date().isoformat(),
+                'set': set_code,
+                'collector_number': str(rng.randint(1, 350)),
+                'prices': {'eur': f"{eur:.2f}", 'eur_foil': f"{eur * 2.5:.2f}", 'usd': None},
+            })
+    return printings
+
+
+def make_entry(rng, printing, history, start):
+    finish = rng.choices([None, 'foil', 'etched'], weights=[88, 10, 2])[0]
+    price = float(printing['prices']['eur_foil' if finish else 'eur'])
+    price_history = []
+    for n in range(history):
+        price = round(max(0.02, price * rng.uniform(0.9, 1.1)), 2)
+        date = (start + timedelta(days=7 * n)).isoformat() + 'Z'
+        price_history.append({'date': date, 'price': price, 'currency': 'eur'})
+    return {
+        'bookshelf_type': 'mtg',
+        'version': '1.0',
+        'name': printing['name'],
+        'oracle_id': printing['oracle_id'],
+        'scryfall_id': printing['id'],
+        'set': printing['set'],
+        'collector_number': printing['collector_number'],
+        'finish': finish,
+        'price': price_history[-1]['price'],
+        'price_history': price_history,
+    }
+
+
+def generate(home, cards=10000, depth=3, fanout=4, layout='mixed', history=12, bulk_extra=1.0, seed=1):
+    """ Write the synthetic home and return a description of it. """
+    rng = random.Random(seed)
+    home = Path(home)
+    shelfs = shelf_tree(home / 'mtg', depth, fanout)
+    for n, shelf in enumerate(shelfs):
+        shelf.mkdir(parents=True, exist_ok=True)
+        if n % 3 == 1:
+            with open(shelf / METADATA_NAME, 'w') as f:
+                json.dump({'bookshelf_type': 'bookshelf_metadata', 'tagline': f"Synthetic shelf {n}"}, f, indent=2)
+
+    printings = make_printings(rng, cards)
+    start = datetime(2023, 1, 1)
+    for n in range(cards):
+        printing = rng.choice(printings)
+        entry = make_entry(rng, printing, max(1, history), start)
+        shelf = rng.choice(shelfs)
+        entry_id = f"{printing['name'].lower().replace(' // ', '-')}-{uuid.UUID(int=rng.getrandbits(128))}"
+        if layout == 'folder' or (layout == 'mixed' and n % 2):
+            (shelf / entry_id).mkdir()
+            path = shelf / entry_id / METADATA_NAME
+        else:
+            path = shelf / f"{entry_id}{METADATA_NAME}"
+        with open(path, 'w') as f:
+            f.write(json.dumps(entry, indent=2))
+
+    # Bulk data holds every owned printing and a share of printings nobody owns, one card per line like Scryfall.
+    unowned = (dict(p, id=str(uuid.UUID(int=rng.getrandbits(128))))
+               for p in rng.choices(printings, k=int(len(printings) * bulk_extra)))
+    bulk_cards = 0
+    (home / 'resources').mkdir(exist_ok=True)
+    with open(home / 'resources' / 'cards.json', 'w') as f:
+        f.write('[')
+        for card in itertools.chain(printings, unowned):
+            f.write((',\n' if bulk_cards else '\n') + json.dumps(card))
+            bulk_cards += 1
+        f.write('\n]\n')
+
+    parents = {shelf.parent for shelf in shelfs}
+    leafs = [shelf for shelf in shelfs if shelf not in parents]
+    return {
+        'home': str(home),
+        'cards': cards,
+        'depth': depth,
+        'fanout': fanout,
+        'layout': layout,
+        'history': history,
+        'shelfs': [str(shelf.relative_to(home)) for shelf in shelfs],
+        'leaf_shelfs': [str(shelf.relative_to(home)) for shelf in leafs],
+        'sample_name': printings[0]['name'],
+        'sample_set': printings[0]['set'],
+        'bulk_cards': bulk_cards,
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument('--cards', type=int, default=10000)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--layout', choices=LAYOUTS, default='mixed')
+    parser.add_argument('--history', type=int, default=12, help="Price history length of every entry.")
+    parser.add_argument('--bulk-extra', type=float, default=1.0, help="Unowned bulk printings per owned printing.")
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('home')
+    add_arguments(parser)
+    args = parser.parse_args()
+    description = generate(args.home, args.cards, args.depth, args.fanout, args.layout, args.history, args.bulk_extra,
+                           args.seed)
+    print(json.dumps({k: v for k, v in description.items() if k not in ('shelfs', 'leaf_shelfs')}))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,6 +21,9 @@ setup(
         "pycolors",
         "GitPython"
     ],
+    extras_require={
+        "value-history": ["numpy"],
+    },
     entry_points={
         "console_scripts": [
             "bookshelf=src.__main__:main",
@@ -1,3 +1,4 @@
+import io
 import os
 import json
 import uuid
@@ -5,26 +6,54 @@ import sys
 import json
 import itertools
 import functools
+import contextlib
+import hashlib
+import time
+import heapq
+import threading
 from typing import List, Dict
 import itertools as it
 
 from dataclasses import dataclass
 from pathlib import Path
 
-from git import Repo
 from pyclicommander import Commander
 
-from .bookshelf_config import config, find_plugin
-from .bookshelf_errors import NoPriceFoundError, NoEntryFound
+from .bookshelf_config import config, find_plugin, all_plugins, make_private_dir
+from .bookshelf_errors import NoPriceFoundError, NoEntryFound, AmbiguousEntry, InvalidQuery
+from .bookshelf_index import METADATA_NAME, RACY_WINDOW_NS, SHELF_TOTALS, MetadataIndex, read_metadata
+from .bookshelf_profile import profile
+from .bookshelf_output import Output
+from .bookshelf_query import Query
+from .plugin_base import compact_price_history
 
 commander = Commander('bookshelf')
 
 home_path = str(Path(config.home).absolute())
-IGNORED_FOLDERS = ['.git']
+IGNORED_FOLDERS = ['.git', '.bookshelf']
 ACCEPTABLE_SORTS = ['name', 'price']
 
+metadata_index = MetadataIndex(Path(config.home) / config.index) if config.index else None
+# Shelf listings kept in memory by `bookshelf serve`.
+resident_shelfs = None
+
 
 def main():
+    # --profile[=MODE] is global, take it out before the command line is parsed.
+    mode = os.environ.get('BOOKSHELF_PROFILE')
+    for arg in sys.argv[1:]:
+        if arg == '--profile' or arg.startswith('--profile='):
+            sys.argv.remove(arg)
+            mode = arg.partition('=')[2] or 'summary'
+            break
+    if mode:
+        return profile.run(commander.call_with_help, mode)
+
+    if config.socket and sys.argv[1:2] and (socket_path := Path(config.home) / config.socket).exists():
+        from .bookshelf_daemon import forward
+        served, code = forward(socket_path, sys.argv[1:])
+        if served:
+            return code
     return commander.call_with_help()
 
 
@@ -53,53 +82,227 @@ class Bookshelf:
     current_path: Path
 
     def __iter__(self):
-        books, sub_shelfs, metadata = self.__get_books_and_shelfs()
-        if self.flatten and (self.depth is None or self.depth > 0):
-            for sub_shelf in sub_shelfs:
-                sub_bookshelf = Bookshelf(sub_shelf.path, depth=(self.depth and self.depth-1), flatten=True, filters=self.filters)
-                books.extend(list(sub_bookshelf)[0][1])  # take second part of tuple from first element of list.
-                
+        if self.flatten:
+            books = []
+            metadata = None
+            for shelf_path, shelf_books, _sub_shelfs, shelf_metadata in self.walk():
+                if shelf_path == self.current_path:
+                    metadata = shelf_metadata
+                    top_level = 0
+                else:
+                    top_level += shelf_path.parent == self.current_path
+                books.extend((top_level, book) for book in shelf_books)
+            with profile.phase('sort'):
+                books = self.__sort_flattened(books)
+            yield (self.current_path, books, metadata)
+        else:
+            for shelf_path, books, _sub_shelfs, metadata in self.walk():
+                with profile.phase('sort'):
+                    self.__sort(books)
+                yield (shelf_path, books, metadata)
+
+    def walk(self):
+        """ Walk shelfs in pre-order within depth, yielding (path, books, sub_shelfs, metadata) with books unsorted. """
+        stack = [(self.current_path, self.depth)]
+        while stack:
+            shelf_path, depth = stack.pop()
+            books, sub_shelfs, metadata = self.__get_books_and_shelfs(shelf_path)
+            if shelf_path == self.current_path:
+                self.sub_shelfs = sub_shelfs
+            yield shelf_path, books, sub_shelfs, metadata
+
+            if depth is None or depth > 0:
+                stack.extend((sub_shelf.path, depth and depth-1) for sub_shelf in reversed(sub_shelfs))
+
+    def scan(self):
+        """ Walk shelfs in pre-order within depth, only stat'ing metadata files while keeping the index fresh.
+
+        Yields (shelf_path, top_level, entries, shelf_metadata_path) with entries as (metadata_path, stat, book_path)
+        for the shelf's books, top_level numbers the sub-shelf of the current shelf a shelf is found under.
+        """
+        stack = [(self.current_path, self.depth, 0)]
+        while stack:
+            shelf_path, depth, top_level = stack.pop()
+            books = []
+            sub_shelfs = []
+            seen_metadata = []
+            shelf_metadata_path = None
+            with profile.phase('scan'), os.scandir(shelf_path) as entries:
+                for entry in entries:
+                    if entry.is_dir() and entry.name not in IGNORED_FOLDERS:
+                        metadata_path = os.path.join(entry.path, METADATA_NAME)
+                        profile.count('files_stat')
+                        try:
+                            stat = os.stat(metadata_path)
+                        except FileNotFoundError:
+                            sub_shelfs.append(entry.path)
+                            continue
+                        seen_metadata.append(metadata_path)
+                        if metadata_type(metadata_path, stat) == 'bookshelf_metadata':
+                            sub_shelfs.append(entry.path)
+                        else:
+                            books.append((metadata_path, stat, Path(entry.path)))
+                    elif entry.is_file() and entry.name.endswith(METADATA_NAME):
+                        seen_metadata.append(entry.path)
+                        profile.count('files_stat')
+                        stat = entry.stat()
+                        if (btype := metadata_type(entry.path, stat)) == 'bookshelf_metadata':
+                            shelf_metadata_path = entry.path
+                        elif btype:
+                            books.append((entry.path, stat, Path(entry.path)))
+
+            if metadata_index:
+                metadata_index.prune(shelf_path, seen_metadata)
+                metadata_index.commit()
+            yield shelf_path, top_level, books, shelf_metadata_path
+
+            if depth is None or depth > 0:
+                for sub_top_level, sub_shelf in reversed(list(enumerate(sub_shelfs, start=1))):
+                    stack.append((Path(sub_shelf), depth and depth-1, top_level or sub_top_level))
+
+    def find(self, terms):
+        """ Flattened and sorted books matching all (term, op, value) index terms, see MetadataIndex.find.
+
+        The shelfs are only stat'ed to keep the index fresh, metadata is loaded for matching books alone.
+        """
+        if resident_shelfs is not None or not (metadata_index and metadata_index.open()):
+            filters = self.filters + [Query(terms=terms).predicate]
+            [(_shelf_path, books, _metadata)] = Bookshelf(self.current_path, depth=self.depth, sort_by=self.sort_by,
+                                                          flatten=True, filters=filters, jobs=self.jobs)
+            return books
+
+        in_scope = {}
+        for _shelf_path, top_level, books, _shelf_metadata_path in self.scan():
+            for metadata_path, _stat, book_path in books:
+                in_scope[metadata_path] = (len(in_scope), top_level, book_path)
+
+        matches = sorted((in_scope[path], book) for path, book in metadata_index.find(terms) if path in in_scope)
+        books = [(top_level, (book_path, book))
+                 for (_order, top_level, book_path), book in matches if self.__keep(book)]
+        with profile.phase('sort'):
+            return self.__sort_flattened(books)
+
+    def top(self, n):
+        """ The first n books in sort order across every shelf within depth, see top_books. """
+        books = (book for _shelf_path, shelf_books, _sub_shelfs, _metadata in self.walk() for book in shelf_books)
+        return top_books(books, n, self.sort_by)
+
+    def totals(self):
+        """ Totals of the books of every shelf within depth as (path, totals, metadata), see SHELF_TOTALS.
+
+        Totals are cached in the index by the signature of a shelf's entries, the books of an unchanged shelf are
+        not loaded at all. Flattened, the totals of all shelfs are rolled up into the current shelf.
+        """
+        rollup = dict.fromkeys(SHELF_TOTALS, 0)
+        current_metadata = None
+        for shelf_path, _top_level, entries, shelf_metadata_path in self.scan():
+            signature = entries_signature(entries)
+            if not (totals := metadata_index and metadata_index.shelf_totals(shelf_path, signature)):
+                totals = shelf_totals(load_book(path, stat) for path, stat, _book_path in entries)
+                # Like the index, only trust the stats of files that can no longer change unnoticed.
+                if metadata_index and entries_settled(entries):
+                    metadata_index.store_shelf_totals(shelf_path, signature, totals)
+            metadata = load_metadata(shelf_metadata_path) if shelf_metadata_path else None
+
+            if not self.flatten:
+                yield shelf_path, totals, metadata
+            else:
+                for total in SHELF_TOTALS:
+                    rollup[total] += totals[total]
+                if shelf_path == self.current_path:
+                    current_metadata = metadata
+
+        if metadata_index:
+            metadata_index.commit()
+        if self.flatten:
+            yield self.current_path, rollup, current_metadata
+
+    def __sort(self, books):
         if self.sort_by == 'name':
             books.sort(key=lambda b: b[1]['name'])
         elif self.sort_by == 'price':
             books.sort(key=lambda b: latest_price(b[1]))
 
-        yield (self.current_path, books, metadata)
+    def __sort_flattened(self, books):
+        """ Sort once, ordering ties like the former per level sorts did.
 
-        if not self.flatten and (self.depth is None or self.depth > 0):
-            for sub_shelf in sub_shelfs:
-                yield from Bookshelf(sub_shelf.path, sort_by=self.sort_by, depth=(self.depth and self.depth-1), filters=self.filters)
+        Sub-shelfs used to be flattened and sorted by name on their own before being merged into the
+        parent, so among equal keys books from a top level sub-shelf tree come ordered by name.
+        """
+        if self.sort_by == 'name':
+            books.sort(key=lambda b: b[1][1]['name'])
+        elif self.sort_by == 'price':
+            books.sort(key=lambda b: (latest_price(b[1][1]), b[0], b[1][1]['name'] if b[0] else ''))
+        return [book for _top_level, book in books]
 
-    def __get_books_and_shelfs(self):
+    def __get_books_and_shelfs(self, shelf_path):
         books = []
         sub_shelfs = []
         metadata = None
 
-        for f in self.current_path.iterdir():
-            if f.is_dir() and f.name not in IGNORED_FOLDERS:
-                possible_book = f / '.bookshelf.metadata'
-                if possible_book.exists():
-                    with open(possible_book, 'r') as book_data:
-                        book = json.load(book_data)
-                    if book.get('bookshelf_type') != 'bookshelf_metadata':
-                        if not self.filters or all(filter_fun(book) for filter_fun in self.filters):
-                            books.append((f, book))
-                    else:
-                        sub_shelfs.append(SubShelfInfo(f, book))
+        for path, is_dir, book in self.__list_shelf(shelf_path):
+            if is_dir:
+                if book is None:
+                    sub_shelfs.append(SubShelfInfo(path))
+                elif book.get('bookshelf_type') != 'bookshelf_metadata':
+                    if self.__keep(book):
+                        books.append((path, book))
                 else:
-                    sub_shelfs.append(SubShelfInfo(f))
-            elif f.is_file() and f.name.endswith('.bookshelf.metadata'):
-                with open(f, 'r') as book_data:
-                    book = json.load(book_data)
-                if btype := book.get('bookshelf_type'):
-                    if btype == 'bookshelf_metadata':
-                        metadata = book
-                    elif not self.filters or all(filter_fun(book) for filter_fun in self.filters):
-                        books.append((f, book))
-        return books, sub_shelfs, metadata
+                    sub_shelfs.append(SubShelfInfo(path, book))
+            elif btype := book.get('bookshelf_type'):
+                if btype == 'bookshelf_metadata':
+                    metadata = book
+                elif self.__keep(book):
+                    books.append((path, book))
 
+        return books, sub_shelfs, metadata
 
-    def __init__(self, shelf, depth=None, sort_by='name', filters=None, flatten=False):
+    def __list_shelf(self, shelf_path):
+        """ (path, is_dir, metadata) of a shelf's folders and metadata files, metadata None for a folder without
+        any. """
+        # A listing is only kept resident while everything it depends on is watched.
+        resident = resident_shelfs is not None
+        if resident:
+            if (listing := resident_shelfs.get(shelf_path)) is not None:
+                return listing
+            resident = resident_shelfs.watch(shelf_path)
+
+        with profile.phase('scandir'), os.scandir(shelf_path) as entries:
+            entries = [entry for entry in entries
+                       if (entry.is_dir() and entry.name not in IGNORED_FOLDERS)
+                       or (entry.is_file() and entry.name.endswith(METADATA_NAME))]
+
+        if resident:
+            resident = resident_shelfs.watch(*(entry.path for entry in entries if entry.is_dir()))
+        with profile.phase('load'):
+            listing = [(Path(entry.path), entry.is_dir(), book)
+                       for entry, book in zip(entries, self.__map(load_entry_metadata, entries))]
+
+        if metadata_index:
+            metadata_index.prune(shelf_path, [metadata_file(path) for path, is_dir, book in listing
+                                              if not is_dir or book is not None])
+            metadata_index.commit()
+        if resident:
+            resident_shelfs.put(shelf_path, listing)
+        return listing
+
+    def __keep(self, book):
+        """ Whether book passes all filters. """
+        if not self.filters:
+            return True
+        with profile.phase('filter'):
+            if all(filter_fun(book) for filter_fun in self.filters):
+                return True
+        profile.count('books_filtered')
+        return False
+
+    def __map(self, fun, items):
+        """ Map in order, on a thread pool when more than one job is asked for. """
+        if self.jobs > 1 and len(items) > 1:
+            return thread_pool(self.jobs).map(fun, items)
+        return map(fun, items)
+
+    def __init__(self, shelf, depth=None, sort_by='name', filters=None, flatten=False, jobs=None):
         """ List books and sub-bookshelfs """
         shelf_path = Path(config.home) / (shelf or '')
         # plugin = find_plugin(fix_shelf_prefix(shelf_path))
@@ -117,10 +320,13 @@ class Bookshelf:
         self.sort_by = 'name' if sort_by not in ACCEPTABLE_SORTS else sort_by
         self.filters = filters if filters else []
         self.flatten = flatten
+        self.jobs = try_int(jobs) or config.jobs
+        self.sub_shelfs = None
 
     def get_sub_shelfs(self):
-        _books, sub_shelfs, _metadata = self.__get_books_and_shelfs()
-        return sub_shelfs
+        if self.sub_shelfs is None:
+            _books, self.sub_shelfs, _metadata = self.__get_books_and_shelfs(self.current_path)
+        return self.sub_shelfs
 
     def add_filter(self, b):
         self.filters.append(b)
@@ -141,8 +347,120 @@ def fix_shelf_prefix(shelf):
     return fixed_shelf or '~root~'
 
 
+def load_metadata(metadata_path, stat=None):
+    if metadata_index:
+        return metadata_index.load(metadata_path, stat)
+    return read_metadata(metadata_path)
+
+
+def load_book(metadata_path, stat=None):
+    """ Like load_metadata, but entries come as compact BookRecords when the index is used. """
+    if metadata_index:
+        return metadata_index.load_book(metadata_path, stat)
+    return read_metadata(metadata_path)
+
+
+def metadata_file(book_path):
+    """ Metadata file of an entry, being either a folder or the metadata file itself. """
+    if book_path.name.endswith(METADATA_NAME):
+        return book_path
+    return book_path / METADATA_NAME
+
+
+def write_metadata(metadata_path, book):
+    """ Atomically replace metadata_path with book, returns False if the file already had that content. """
+    content = json.dumps(dict(book), indent=2)
+    try:
+        with open(metadata_path, 'r') as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+
+    write_atomic(metadata_path, content)
+    return True
+
+
+def write_atomic(path, content):
+    """ Write content to a temporary file and rename it over path, readers never see a partial file. """
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb' if isinstance(content, bytes) else 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        profile.count('files_written')
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def metadata_type(metadata_path, stat):
+    """ bookshelf_type of a metadata file, without parsing it again when the index knows it. """
+    if metadata_index:
+        return metadata_index.refresh(metadata_path, stat)
+    return read_metadata(metadata_path).get('bookshelf_type')
+
+
+def load_entry_metadata(entry):
+    """ Metadata of a scandir entry, None for a folder without any. """
+    profile.count('files_stat')
+    if entry.is_dir():
+        try:
+            return load_book(os.path.join(entry.path, METADATA_NAME))
+        except FileNotFoundError:
+            return None
+    return load_book(entry.path, entry.stat())
+
+
+@functools.lru_cache(maxsize=None)
+def thread_pool(jobs):
+    from concurrent.futures import ThreadPoolExecutor  # Pulls in logging, keep it off the startup path.
+    return ThreadPoolExecutor(max_workers=jobs)
+
+
 def latest_price(book):
-    return get_prices(book)[-1]
+    if 'price' in book:
+        return book['price']
+    return book['price_history'][-1]['price']
+
+
+def entries_signature(entries):
+    """ Hash of the stats of (metadata_path, stat, book_path) entries, changes with any entry added, removed or
+    modified. """
+    return hashlib.sha1(''.join(f"{path}:{stat.st_mtime_ns}:{stat.st_size}\n" for path, stat, _ in sorted(entries))
+                        .encode()).hexdigest()
+
+
+def entries_settled(entries):
+    """ Whether no entry was modified within the racy window, only then can their signature be trusted. """
+    now = time.time_ns()
+    return all(now - stat.st_mtime_ns > RACY_WINDOW_NS for _path, stat, _book_path in entries)
+
+
+def shelf_totals(books):
+    totals = {'count': 0, 'price': 0.0, 'foils': 0, 'foil_price': 0.0}
+    for book in books:
+        totals['count'] += 1
+        totals['price'] += latest_price(book)
+        if book.get('finish') is not None:
+            totals['foils'] += 1
+            totals['foil_price'] += latest_price(book)
+    return totals
+
+
+def top_books(books, n, sort_by='name'):
+    """ The first n of (path, book) by name, or the n most expensive by price, without sorting them all.
+
+    Books are streamed through a heap of n, ties are ordered by name and path.
+    """
+    def by_name(b):
+        return b[1]['name'], str(b[0])
+
+    def by_price(b):
+        return -latest_price(b[1]), b[1]['name'], str(b[0])
+
+    with profile.phase('sort'):
+        return heapq.nsmallest(n, books, key=by_price if sort_by == 'price' else by_name)
 
 
 def get_prices(book):
@@ -151,8 +469,12 @@ def get_prices(book):
 #
 # ===================================================================================================================
 #
-@commander.cli("ls [SHELF] [-q] [-qq] [-r] [-t] [--no-group] [--sort-by=METHOD] [--price-sum] [--price-min=X] [--price-max=X] [--foil] [--flatten] [--reprint-group]")
-def cmd_ls(shelf=None, q=False, qq=False, r=False, t=False, no_group=False, sort_by='name', price_sum=False, price_min=None, price_max=None, foil=False, flatten=False, reprint_group=False):
+@commander.cli("ls [SHELF] [-q] [-qq] [-r] [-t] [--no-group] [--sort-by=METHOD] [--price-sum] [--price-min=X] "
+               "[--price-max=X] [--foil] [--flatten] [--reprint-group] [--top=N] [--jobs=N] [--format=FORMAT] "
+               "[--query=EXPR]")
+def cmd_ls(shelf=None, q=False, qq=False, r=False, t=False, no_group=False, sort_by='name', price_sum=False,
+           price_min=None, price_max=None, foil=False, flatten=False, reprint_group=False, top=None, jobs=None,
+           format=None, query=None):
     """ Browse your bookshelf.
 
 Flags
@@ -166,24 +488,66 @@ Flags
     --sort-by=METHOD    Where METHOD = 'name' | 'price'
     --price-sum         Sum up prices from shelfs listed.
     --flatten           Treat all bookshelfs as if it was one big shelf.
+    --top=N             List only the first N entries of all shelfs listed, the most expensive ones with
+                        --sort-by=price.
+    --jobs=N            Load entries using N threads.
+    --format=FORMAT     Where FORMAT = 'text' | 'jsonl' | 'tsv', jsonl and tsv list one entry record per line only.
 
 Filter flags
 --------
     --price-min=X       Filter entries with its latest price being over X.
     --price-max=X       Filter entries with its latest price being under X.
     --foil              Filter entries that are foil.
+    --query=EXPR        Filter entries matching EXPR, eg.
+                        'name~"bolt" and price>5 and set in (lea, leb) and finish=foil'.
+                        Fields are name, set, collector_number, oracle_id, scryfall_id, finish and price.
     """
  
     total_price = 0.0
+    if format not in (None, *Output.formats):
+        print(f"Unknown format {format}, use one of {', '.join(Output.formats)}")
+        return -1
+    out = Output(format, fix_shelf_prefix)
 
-    bookshelf = Bookshelf(shelf, sort_by=sort_by, depth=(None if r else 0), flatten=flatten)
-
+    terms = []
     if price_min := try_float(price_min):
-        bookshelf.add_filter(lambda b: latest_price(b) > price_min)
+        terms.append(('price', '>', price_min))
     if price_max := try_float(price_max):
-        bookshelf.add_filter(lambda b: latest_price(b) < price_max)
+        terms.append(('price', '<', price_max))
     if foil:
-        bookshelf.add_filter(lambda b: b.get('finish') is not None)
+        terms.append(('finish', '!=', None))
+    try:
+        book_query = Query(query, terms)
+    except InvalidQuery as error:
+        print(error)
+        return -1
+
+    bookshelf = Bookshelf(shelf, sort_by=sort_by, depth=(None if r else 0), flatten=flatten, jobs=jobs)
+    if not book_query.empty:
+        bookshelf.add_filter(book_query.predicate)
+
+    if top is not None:
+        for book_path, book in bookshelf.top(int(top)):
+            total_price += latest_price(book)
+            if not q:
+                out.entry(find_plugin(fix_shelf_prefix(book_path)), book, book_path, only_title=t,
+                          prefix=f"{fix_shelf_prefix(book_path.parents[0])} => ")
+        if price_sum:
+            out.text(f"Total price: €{round(total_price, 2)}")
+        out.flush()
+        return
+
+    # Without entries or sub-shelfs to list, totals cached per shelf are all there is to print.
+    if q and (r or qq) and not price_min and not price_max and not query and resident_shelfs is None:
+        for current_path, totals, metadata in bookshelf.totals():
+            count, shelf_price = (totals['foils'], totals['foil_price']) if foil else (totals['count'], totals['price'])
+            total_price += shelf_price
+            if not qq:
+                out.text(shelf_header(current_path, count, shelf_price, metadata))
+        if price_sum:
+            out.text(f"Total price: €{round(total_price, 2)}")
+        out.flush()
+        return
 
     for current_path, books, metadata in bookshelf:
         plugin = find_plugin(fix_shelf_prefix(current_path))
@@ -192,66 +556,66 @@ Filter flags
         grouped_books = []
         prev_title = None
         current_groups = {}
-        for book_path, book in books:
-            shelf_price += latest_price(book)
-            book_title = plugin.get_title(book)
-            book_id = plugin.get_unique_id(book, edition=not reprint_group)
-            if prev_title != book_title or no_group:
-                prev_title = book_title
-                grouped_books.extend(current_groups.values())
-                current_groups = {}
-            current_groups.setdefault(book_id, []).append((book_path, book))
-        grouped_books.extend(current_groups.values())
+        with profile.phase('group'):
+            for book_path, book in books:
+                shelf_price += latest_price(book)
+                book_title = plugin.get_title(book)
+                book_id = plugin.get_unique_id(book, edition=not reprint_group)
+                if prev_title != book_title or no_group:
+                    prev_title = book_title
+                    grouped_books.extend(current_groups.values())
+                    current_groups = {}
+                current_groups.setdefault(book_id, []).append((book_path, book))
+            grouped_books.extend(current_groups.values())
         total_price += shelf_price
 
         if not qq:
-            print(f"=> {fix_shelf_prefix(current_path)} ({len(books)}) [€{round(shelf_price, 2)}]", end="")
-            if metadata:
-                print(f" - {metadata['tagline']}")
-            else:
-                print("")
+            out.text(shelf_header(current_path, len(books), shelf_price, metadata))
 
         if not q:
             for group in grouped_books:
-                plugin.print_metadata(group[0][1], only_title=t, multiples=None if no_group else len(group))
+                book_path, book = group[0]
+                out.entry(plugin, book, book_path, only_title=t, multiples=None if no_group else len(group))
 
         if not qq and not r and (sub_shelfs := bookshelf.get_sub_shelfs()):
             max_column = max([len(fix_shelf_prefix(s.path)) for s in sub_shelfs]) + 1
             for sub_shelf in sub_shelfs:
-                print(f"==> {fix_shelf_prefix(sub_shelf.path):{max_column}}", end="")
+                sub_shelf_line = f"==> {fix_shelf_prefix(sub_shelf.path):{max_column}}"
                 if sub_shelf.metadata:
-                    print(f"- {sub_shelf.metadata.get('tagline')}")
-                else:
-                    print("")
+                    sub_shelf_line += f"- {sub_shelf.metadata.get('tagline')}"
+                out.text(sub_shelf_line)
 
         # if not qq and not q:
             # print("")
 
     if price_sum:
-        print(f"Total price: €{round(total_price, 2)}")
+        out.text(f"Total price: €{round(total_price, 2)}")
+    out.flush()
+
+
+def shelf_header(shelf_path, count, shelf_price, metadata):
+    header = f"=> {fix_shelf_prefix(shelf_path)} ({count}) [€{round(shelf_price, 2)}]"
+    if metadata:
+        header += f" - {metadata['tagline']}"
+    return header
 
 
 #
 # ===================================================================================================================
 #
-@commander.cli("add SHELF [ENTRY] [--times=N] [--foil] [--etched] [--cardset=SET] [--price=M] [--find-old]")
-def add_entry(shelf, entry=None, times=1, foil=False, etched=False, cardset=None, price=None, find_old=False):
+@commander.cli("add SHELF [ENTRY] [--times=N] [--foil] [--etched] [--cardset=SET] [--price=M] [--find-old] "
+               "[--from-file=LIST]")
+def add_entry(shelf, entry=None, times=1, foil=False, etched=False, cardset=None, price=None, find_old=False,
+              from_file=None):
     """ Add stuff to your bookshelf.
 
 Flags
 --------
     --times=N           Add N copies.
     --price=M           Use price given instead of looking it up.
+    --from-file=LIST    Add every entry listed in LIST, one per line, eg. "4 Lightning Bolt (2XM) 129 *F*".
     """
 
-    def entrify(entry_name):
-        entry_split = entry_name.split("/")
-        if len(entry_split) > 1:
-            name = entry_split[0]
-        else:
-            name = entry_name
-        return name.replace('\'', '').replace(',', '').strip().lower()
-
     plugin = find_plugin(shelf)
 
     # FIXME: (MTG) Determine 'finish' for card entry
@@ -267,6 +631,29 @@ Flags
     if price:
         price = float(price)
 
+    if from_file:
+        if not plugin:
+            print("Nothing found.")
+            return -1
+        try:
+            entry_requests = plugin.read_entry_list(from_file)
+        except NoEntryFound as e:
+            print(f"Could not read entry: {e}")
+            return -1
+        for entry_request in entry_requests:
+            entry_request['finish'] = entry_request['finish'] or finish
+            entry_request['price'] = price
+
+        failed = 0
+        for entry_request, entry_info in zip(entry_requests, plugin.get_entries_info(entry_requests)):
+            if isinstance(entry_info, Exception):
+                failed += 1
+                print(f"Lookup failed for entry: {entry_request['entry']} ({entry_request['cardset'] or '-'}) "
+                      f"{describe_lookup_error(entry_info)}")
+            else:
+                store_entry(plugin, shelf, entry_info, entrify(entry_info.get('name')), entry_request['times'])
+        return -1 if failed else None
+
     # FIXME: PluginMTGify
     # Find card on scryfall
     try:
@@ -277,6 +664,9 @@ Flags
     except NoEntryFound:
         print("Lookup failed for entry")
         return -1
+    except AmbiguousEntry as e:
+        print(e.candidates)
+        return
 
 #    if find_old:
 #        for shelf_path, books in Bookshelf(shelf, depth=recursive):
@@ -284,34 +674,53 @@ Flags
 
     # Put into bookshelf.
     if entry_info:
-        for n in range(int(times)):
-            entry_name = entry if entry else entrify(entry_info.get('name'))
-            entry_id = f"{entry_name}-{str(uuid.uuid4())}"
-            path_metadata = None
-
-            if plugin.new_entry == 'folder' or (plugin.new_entry == None and config.new_entry == 'folder'):
-                path = os.path.join(config.home, shelf, entry_id)
-                Path(path).mkdir(parents=True)
-                path_metadata = os.path.join(path, '.bookshelf.metadata')
-            else:
-                path = os.path.join(config.home, shelf)
-                if not Path(path).exists:
-                    Path(path).mkdir(parents=True)
-                path_metadata = os.path.join(path, f'{entry_id}.bookshelf.metadata')
+        store_entry(plugin, shelf, entry_info, entry if entry else entrify(entry_info.get('name')), times)
+    else:
+        print("Nothing found.")
 
-            with open(path_metadata, 'w') as f:
-                f.write(json.dumps(entry_info, indent=2))
 
-            print(f"{fix_shelf_prefix(shelf)} => {plugin.metadata_stringify(entry_info, multiples=None)}")
+def entrify(entry_name):
+    entry_split = entry_name.split("/")
+    if len(entry_split) > 1:
+        name = entry_split[0]
     else:
-        print("Nothing found.")
+        name = entry_name
+    return name.replace('\'', '').replace(',', '').strip().lower()
+
+
+def describe_lookup_error(error):
+    if isinstance(error, NoPriceFoundError):
+        return "- no price information available"
+    elif isinstance(error, AmbiguousEntry):
+        return f"- candidates: {error.candidates}"
+    return ""
+
+
+def store_entry(plugin, shelf, entry_info, entry_name, times=1):
+    for n in range(int(times)):
+        entry_id = f"{entry_name}-{str(uuid.uuid4())}"
+        path_metadata = None
+
+        if plugin.new_entry == 'folder' or (plugin.new_entry == None and config.new_entry == 'folder'):
+            path = os.path.join(config.home, shelf, entry_id)
+            Path(path).mkdir(parents=True)
+            path_metadata = os.path.join(path, '.bookshelf.metadata')
+        else:
+            path = os.path.join(config.home, shelf)
+            Path(path).mkdir(parents=True, exist_ok=True)
+            path_metadata = os.path.join(path, f'{entry_id}.bookshelf.metadata')
+
+        with open(path_metadata, 'w') as f:
+            f.write(json.dumps(entry_info, indent=2))
+
+        print(f"{fix_shelf_prefix(shelf)} => {plugin.metadata_stringify(entry_info, multiples=None)}")
 
 
 #
 # ===================================================================================================================
 #
-@commander.cli("price-update SHELF [ENTRY] [PRICE] [-r] [--dry] [--min-change=X]")
-def price_update(shelf, entry=None, price=None, r=False, dry=False, min_change=None):
+@commander.cli("price-update SHELF [ENTRY] [PRICE] [-r] [--dry] [--min-change=X] [--changed-only] [--jobs=N]")
+def price_update(shelf, entry=None, price=None, r=False, dry=False, min_change=None, changed_only=False, jobs=None):
     """ Update shelf with prices either by lookup or by given price. 
 
 Flags
@@ -319,31 +728,43 @@ Flags
     -r                  Recursivly browse the shelfs.
     --dry               Get a preview of how update would look like by doing a dry run.
     --min-change=X      Only update if change difference is larger than X.
+    --changed-only      Record when the shelf was checked in a side file, and skip a shelf already checked
+                        against the same price snapshot with no entry changed since.
+    --jobs=N            Load and write entries using N threads.
     """
     recursive = None if r else 0
     min_change = try_float(min_change)
 
+    bookshelf = Bookshelf(shelf, depth=recursive, flatten=True, jobs=jobs)
+    if changed_only and (last_check := load_price_checks().get(fix_shelf_prefix(bookshelf.current_path))):
+        plugin = find_plugin(fix_shelf_prefix(bookshelf.current_path))
+        if (plugin and (snapshot := plugin.bulk_data_snapshot()) and last_check.get('snapshot') == snapshot
+                and last_check.get('signature') == books_signature(bookshelf)):
+            print(f"Prices already checked against this snapshot on {last_check['date']}")
+            return
+
     collection = {}
-    for shelf_path, books, _metadata in Bookshelf(shelf, depth=recursive, flatten=True):
+    for shelf_path, books, _metadata in bookshelf:
         plugin = find_plugin(fix_shelf_prefix(shelf_path))
         for book_path, book in books:
             book_id = plugin.get_unique_id(book)
             book_collection = collection.setdefault(book_id, [])
             book_collection.append((book_path, book))
 
-    plugin.price_update(collection)
+    previous_prices = {book_path: latest_price(book) for books in collection.values() for book_path, book in books}
+    with profile.phase('price_update'):
+        plugin.price_update(collection)
 
     price_fluctuation = 0.0
+    pending_writes = []
     for book_id, books in collection.items():
         for book_path, book_info in books:
+            if latest_price(book_info) == previous_prices[book_path]:
+                continue
             p = fix_shelf_prefix(book_path.parents[0])
-            prices = get_prices(book_info)
             price_change_text = "~"
-            if len(prices) > 1:
-                a, b = prices[-2:]  # last two entries.
-                price_change = round(b - a, 2)
-            else:
-                price_change = round(prices[-1], 2)
+            # A card without a price before counts as gaining all of it.
+            price_change = round(latest_price(book_info) - (previous_prices[book_path] or 0.0), 2)
 
             if min_change is None or abs(price_change) >= min_change:
                 price_fluctuation += price_change
@@ -352,16 +773,92 @@ Flags
                 print(f"{p} => {plugin.metadata_stringify(book_info, None)} [{price_change_text}]")
 
                 if not dry:
-                    with open(book_path / '.bookshelf.metadata', 'w') as f:
-                        f.write(json.dumps(book_info, indent=2))
+                    pending_writes.append((metadata_file(book_path), book_info))
 
     print(f"Price fluctuation: {price_fluctuation}")
 
+    if not dry:
+        with profile.phase('write'):
+            pool = thread_pool(try_int(jobs) or config.write_jobs)
+            written = sum(pool.map(lambda w: write_metadata(*w), pending_writes))
+        entries = sum(len(books) for books in collection.values())
+        print(f"Files written: {written}, skipped: {entries - written}")
+        # Only a run that looked at every price stands for the snapshot, --min-change leaves changes behind.
+        if config.price_checks and changed_only and min_change is None:
+            record_price_check(bookshelf.current_path, plugin.get_timestamp(), recursive=bool(r), entries=entries,
+                               changed=written, snapshot=plugin.bulk_data_snapshot(),
+                               signature=books_signature(bookshelf))
+
+
+def books_signature(bookshelf):
+    """ Signature of all entries of a bookshelf within its depth, see entries_signature. """
+    return entries_signature([entry for _shelf_path, _top_level, entries, _metadata_path in bookshelf.scan()
+                              for entry in entries])
+
+
+def load_price_checks():
+    """ When price-update last checked each shelf, from the price_checks side file. """
+    if not config.price_checks:
+        return {}
+    try:
+        return json.loads((Path(config.home) / config.price_checks).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def record_price_check(shelf_path, date, **check):
+    """ Remember when the prices of a shelf were last checked, kept for all shelfs in the price_checks side file. """
+    checks = load_price_checks()
+    checks[fix_shelf_prefix(shelf_path)] = {'date': date, **check}
+    checks_path = Path(config.home) / config.price_checks
+    make_private_dir(checks_path)
+    write_atomic(checks_path, json.dumps(checks, indent=2, sort_keys=True))
+
+
+#
+# ===================================================================================================================
+#
+@commander.cli("compact-history SHELF [-r] [--dry] [--downsample-after=DAYS] [--jobs=N]")
+def compact_history(shelf, r=False, dry=False, downsample_after=None, jobs=None):
+    """ Shrink price histories by dropping repeated prices.
+
+Flags
+--------
+    -r                          Recursivly browse the shelfs.
+    --dry                       Only count what would be dropped.
+    --downsample-after=DAYS     Keep only the last price of each month for prices older than DAYS.
+    --jobs=N                    Load and write entries using N threads.
+    """
+    dropped = 0
+    pending_writes = []
+    for shelf_path, books, _metadata in Bookshelf(shelf, depth=None if r else 0, flatten=True, jobs=jobs):
+        if not (plugin := find_plugin(fix_shelf_prefix(shelf_path))):
+            continue
+        days = try_int(downsample_after) if downsample_after is not None else plugin.downsample_history_after
+        for book_path, book in books:
+            price_history = compact_price_history(book['price_history'], days)
+            dropped += len(book['price_history']) - len(price_history)
+            book['price_history'] = price_history
+            book['price'] = price_history[-1]['price']
+            pending_writes.append((metadata_file(book_path), book))
+
+    print(f"Price entries dropped: {dropped}")
+    if not dry:
+        with profile.phase('write'):
+            pool = thread_pool(try_int(jobs) or config.write_jobs)
+            written = sum(pool.map(lambda w: write_metadata(*w), pending_writes))
+        print(f"Files written: {written}, skipped: {len(pending_writes) - written}")
+
+
 #
 # ===================================================================================================================
 #
-@commander.cli("search [SHELF] [--title=NAME] [--cardset=SET] [--depth=N] [-q] [-t] [--price-sum] [--full-path] [--price-min=X] [--price-max=X]")
-def cmd_search(shelf=None, title=None, cardset=None, depth=None, q=False, t=False, price_sum=False, full_path=False, price_min=None, price_max=None):
+@commander.cli("search [SHELF] [--title=NAME] [--cardset=SET] [--oracle-id=ID] [--depth=N] [-q] [-t] [--price-sum] "
+               "[--full-path] [--price-min=X] [--price-max=X] [--top=N] [--sort-by=METHOD] [--jobs=N] "
+               "[--format=FORMAT] [--query=EXPR]")
+def cmd_search(shelf=None, title=None, cardset=None, oracle_id=None, depth=None, q=False, t=False, price_sum=False,
+               full_path=False, price_min=None, price_max=None, top=None, sort_by='name', jobs=None, format=None,
+               query=None):
     """ Search through your bookshelfs with different filters.
 
 Flags
@@ -371,72 +868,165 @@ Flags
     --depth=N           Limit how deep into the shelfs one looks, default is indefinitly.
     --price-sum         Sum up prices from shelfs listed.
     --full-path         Show the real name of entries.
+    --top=N             Show only the first N entries found, the most expensive ones with --sort-by=price.
+    --sort-by=METHOD    Where METHOD = 'name' | 'price'
+    --jobs=N            Load entries using N threads.
+    --format=FORMAT     Where FORMAT = 'text' | 'jsonl' | 'tsv', jsonl and tsv list one entry record per line only.
 
 Filter flags
 --------
     --price-min=X       Filter entries with its latest price being over X.
     --price-max=X       Filter entries with its latest price being under X.
+    --title=NAME        Filter entries named NAME, ignoring case.
     --cardset=SET       Filter entries that matches, eg. SET, SET#CollectorNumber.
+    --oracle-id=ID      Filter entries being any printing of the card ID.
+    --query=EXPR        Filter entries matching EXPR, eg.
+                        'name~"bolt" and price>5 and set in (lea, leb) and finish=foil'.
+                        Fields are name, set, collector_number, oracle_id, scryfall_id, finish and price.
     """
 
     # Any filters specified?
-    filters = []
+    terms = []
     if price_min := try_float(price_min):
-        filters.append(lambda b: latest_price(b) > price_min)
+        terms.append(('price', '>', price_min))
     if price_max := try_float(price_max):
-        filters.append(lambda b: latest_price(b) < price_max)
+        terms.append(('price', '<', price_max))
     if title is not None:
-        filters.append(lambda b: b['name'].lower() == title.lower())
-    if cardset is not None: 
-        filters.append(lambda b: b['set'] == cardset or f"{b['set']}#{b['collector_number']}" == cardset)
+        terms.append(('name', '=', title))
+    if cardset is not None:
+        setcode, _, collector_number = cardset.partition('#')
+        terms.append(('set', '=', setcode))
+        if collector_number:
+            terms.append(('collector_number', '=', collector_number))
+    if oracle_id is not None:
+        terms.append(('oracle_id', '=', oracle_id))
+    try:
+        book_query = Query(query, terms)
+    except InvalidQuery as error:
+        print(error)
+        return -1
 
-    if not filters:
+    if book_query.empty:
         print("No filters specied.")
         return
+    if format not in (None, *Output.formats):
+        print(f"Unknown format {format}, use one of {', '.join(Output.formats)}")
+        return -1
+    out = Output(format, fix_shelf_prefix)
 
     summed_price = 0.0
-    [(_shelf_path, books, _metadata )] = Bookshelf(shelf, depth=try_int(depth), flatten=True, filters=filters)
+    bookshelf = Bookshelf(shelf, depth=try_int(depth), sort_by=sort_by, flatten=True, filters=[book_query.predicate],
+                          jobs=jobs)
+    # Terms the index answers narrow the books down before any is loaded, the whole query is checked on the rest.
+    if book_query.index_terms:
+        with profile.phase('find'):
+            books = bookshelf.find(book_query.index_terms)
+        if top is not None:
+            books = top_books(books, int(top), bookshelf.sort_by)
+    elif top is not None:
+        books = bookshelf.top(int(top))
+    else:
+        [(_shelf_path, books, _metadata)] = bookshelf
     for book_path, book in books:
         p = fix_shelf_prefix(book_path)
         plugin = find_plugin(p)
         summed_price += latest_price(book)
         if not q:
-            if full_path:
-                print(f"{p} => ", end='')
-            else:
-                print(f"{fix_shelf_prefix(book_path.parents[0])} => ", end='')
-            plugin.print_metadata(book, only_title=t, multiples=None)
+            out.entry(plugin, book, book_path, only_title=t,
+                      prefix=f"{p if full_path else fix_shelf_prefix(book_path.parents[0])} => ")
 
     if price_sum:
-        print(f"Summed up price: {round(summed_price, 2)}")
+        out.text(f"Summed up price: {round(summed_price, 2)}")
+    out.flush()
 
 
 #
 # ===================================================================================================================
 #
 
-@commander.cli("generate-www [SHELF]")
-def generate_www(shelf):
-    cards_json = {}
-    for shelf_path, books, _ in Bookshelf(shelf, depth=None):
-        plugin = find_plugin(fix_shelf_prefix(shelf_path))
-        shelf_json = {}
-        for book_path, book in books:
-            book_title = plugin.get_title(book)
-            r = shelf_json.setdefault(book_title, {})
+@commander.cli("generate-www [SHELF] [--output=DIR] [--gzip] [--single-file]")
+def generate_www(shelf=None, output='www', gzip=False, single_file=False):
+    """ Generate card data for the web page.
 
-            card_set = f"{book['set']}#{book['collector_number']}"
-            if card_finish := book.get('finish'):
-                card_set += f"#{card_finish}"
+Flags
+--------
+    --output=DIR        Directory to write to, default is www.
+    --gzip              Also write precompressed .gz files.
+    --single-file       Write everything into one cards.js instead of a manifest and a file per shelf.
+    """
+    output = Path(output)
+    if single_file:
+        cards_json = {}
+        for shelf_path, books, _ in Bookshelf(shelf, depth=None):
+            if shelf_json := www_shelf_json(shelf_path, books):
+                cards_json[fix_shelf_prefix(shelf_path)] = shelf_json
+        write_www(output / 'cards.js', f"var cards ={json.dumps(cards_json, separators=(',', ':'))};", gzip)
+        return
+
+    # Shelfs are only read when their entries changed since the manifest was written, or were written with
+    # another --gzip.
+    manifest_path = output / 'manifest.json'
+    try:
+        with open(manifest_path, 'r') as f:
+            old_shelfs = json.load(f).get('shelfs', {})
+    except FileNotFoundError:
+        old_shelfs = {}
+
+    shelfs = {}
+    rebuilt = 0
+    for shelf_path, _top_level, entries, _shelf_metadata_path in Bookshelf(shelf, depth=None).scan():
+        if not entries:
+            continue
+        shelf_name = fix_shelf_prefix(shelf_path)
+        signature = entries_signature(entries)
+        if (old_shelf := old_shelfs.get(shelf_name)) and old_shelf['signature'] == signature \
+                and old_shelf.get('gzip', False) == gzip and (output / old_shelf['file']).exists():
+            shelfs[shelf_name] = old_shelf
+            continue
+
+        books = [(book_path, load_book(path, stat)) for path, stat, book_path in entries]
+        shelf_file = f"shelfs/{hashlib.sha1(shelf_name.encode()).hexdigest()[:16]}-{signature[:8]}.json"
+        write_www(output / shelf_file, json.dumps(www_shelf_json(shelf_path, books), separators=(',', ':')), gzip)
+        # Like the index, only trust the stats of files that can no longer change unnoticed.
+        shelfs[shelf_name] = {'file': shelf_file, 'signature': signature if entries_settled(entries) else None,
+                              'count': len(books), 'gzip': gzip}
+        rebuilt += 1
+
+    write_www(manifest_path, json.dumps({'version': 1, 'shelfs': shelfs}, separators=(',', ':')), gzip)
+
+    # Drop files of shelfs that changed or are gone.
+    current_files = {shelf_info['file'] for shelf_info in shelfs.values()}
+    for old_shelf in old_shelfs.values():
+        if old_shelf['file'] not in current_files:
+            for old_file in (output / old_shelf['file'], output / (old_shelf['file'] + '.gz')):
+                old_file.unlink(missing_ok=True)
+
+    print(f"Shelfs written: {rebuilt}, unchanged: {len(shelfs) - rebuilt}")
+
+
+def www_shelf_json(shelf_path, books):
+    plugin = find_plugin(fix_shelf_prefix(shelf_path))
+    shelf_json = {}
+    for book_path, book in books:
+        book_title = plugin.get_title(book)
+        r = shelf_json.setdefault(book_title, {})
 
-            r[card_set] = r.get(card_set, 0) + 1
-        if shelf_json:
-            cards_json[fix_shelf_prefix(shelf_path)] = shelf_json
+        card_set = f"{book['set']}#{book['collector_number']}"
+        if card_finish := book.get('finish'):
+            card_set += f"#{card_finish}"
 
-    with open('www/cards.js', 'w') as f:
-        f.write("var cards =")
-        f.write(json.dumps(cards_json, indent=1))
-        f.write(";")
+        r[card_set] = r.get(card_set, 0) + 1
+    return shelf_json
+
+
+def write_www(path, content, gzip=False):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(path, content)
+    if gzip:
+        import gzip as gz
+        write_atomic(Path(f"{path}.gz"), gz.compress(content.encode(), mtime=0))
+    else:
+        Path(f"{path}.gz").unlink(missing_ok=True)
 
 
 # def make_cards_json(cards):
@@ -465,40 +1055,277 @@ def generate_www(shelf):
 #
 # ===================================================================================================================
 #
-@commander.cli("price-added [SHELF]")
-def price_added(shelf=None):
-    shelf_path = fix_shelf_prefix(Path(config.home) / (shelf or ''))
-    plugin = find_plugin(shelf_path)
+@commander.cli("value-history [SHELF] [-r] [--bucket=SIZE] [--since=DATE] [--until=DATE] [--by-shelf]")
+def value_history(shelf=None, r=False, bucket='month', since=None, until=None, by_shelf=False):
+    """ Value of your bookshelf over time, from the price histories of its entries.
+
+An entry counts from its first price on, at the latest price it had by the end of each period.
+
+Flags
+--------
+    -r                  Recursivly browse the shelfs.
+    --bucket=SIZE       Where SIZE = 'day' | 'week' | 'month', default is month.
+    --since=DATE        Start at DATE, eg. 2024-01-31, default is the first price.
+    --until=DATE        End at DATE, default is today.
+    --by-shelf          Also show the value of each shelf on its own.
+    """
+    try:
+        from .bookshelf_value import BUCKETS, value_series  # NumPy is optional, only this command needs it.
+    except ImportError:
+        print("value-history needs NumPy, install bookshelf[value-history]")
+        return -1
+    if bucket not in BUCKETS:
+        print(f"Unknown bucket {bucket}, use one of {', '.join(BUCKETS)}")
+        return -1
+
+    shelf_names = []
+    shelf_numbers = []
+    days = []
+    prices = []
+    book_starts = []
+    for shelf_path, books, _sub_shelfs, _metadata in Bookshelf(shelf, depth=None if r else 0).walk():
+        shelf_names.append(fix_shelf_prefix(shelf_path))
+        for _book_path, book in books:
+            book_prices = get_prices(book)
+            book_starts.append(len(prices))
+            prices.extend(book_prices)
+            shelf_numbers.extend(itertools.repeat(len(shelf_names) - 1, len(book_prices)))
+            # ISO timestamps as written by get_timestamp, the day is enough for any bucket.
+            days.extend(price_entry['date'][:10] for price_entry in book['price_history'])
+
+    try:
+        labels, values = value_series(shelf_numbers, days, prices, book_starts, len(shelf_names), bucket, since, until)
+    except ValueError as e:
+        print(f"Bad date: {e}")
+        return -1
+
+    if by_shelf:
+        for shelf_name, shelf_values in zip(shelf_names, values):
+            print(f"=> {shelf_name}")
+            for label, value in zip(labels, shelf_values):
+                print(f"{label:10} €{value:.2f}")
+        print("=> Total")
+    for label, value in zip(labels, values.sum(axis=0)):
+        print(f"{label:10} €{value:.2f}")
+
+
+#
+# ===================================================================================================================
+#
+@commander.cli("build-card-index [SHELF]")
+def build_card_index(shelf=None):
+    """ Build offline lookup indexes for add from the downloaded bulk data. """
+    plugins = [find_plugin(shelf)] if shelf else all_plugins()
+    for plugin in plugins:
+        if plugin and getattr(plugin, 'card_index', None):
+            print(f"Indexing {plugin.bulk_data}...")
+            try:
+                print(f"Indexed {plugin.build_card_index()} cards into {plugin.card_index.index_path}")
+            except FileNotFoundError as e:
+                print(f"No bulk data found: {e.filename}")
+                return -1
+
+
+@commander.cli("fetch-prices [SHELF] [--force]")
+def fetch_prices(shelf=None, force=False):
+    """ Download the bulk data price-update reads, unless it is the same snapshot as last time.
+
+Flags
+--------
+    --force             Download even when the snapshot looks unchanged.
+    """
+    plugins = [find_plugin(shelf)] if shelf else all_plugins()
+    for plugin in plugins:
+        if plugin and hasattr(plugin, 'fetch_bulk_data'):
+            print(f"Fetching {plugin.bulk_data}...")
+            try:
+                if plugin.fetch_bulk_data(force):
+                    print(f"Downloaded {plugin.bulk_data} ({os.path.getsize(plugin.bulk_data) / 2**20:.1f} MiB)")
+                else:
+                    print(f"{plugin.bulk_data} is up to date")
+            except OSError as e:
+                # requests errors are OSErrors as well.
+                print(f"Fetching {plugin.bulk_data} failed: {e}")
+                return -1
+
+
+@commander.cli("http-cache [SHELF] [--clear]")
+def http_cache(shelf=None, clear=False):
+    """ Show what the api response cache holds and how much waiting it saved.
+
+Flags
+--------
+    --clear             Drop all cached responses and counters.
+    """
+    plugins = [find_plugin(shelf)] if shelf else all_plugins()
+    for plugin in plugins:
+        if plugin and (cache := getattr(plugin, 'response_cache', None)):
+            if clear:
+                cache.clear()
+                print(f"Cleared {cache.cache_path}")
+                continue
+            stats = cache.stats()
+            print(f"{cache.cache_path}: {stats['responses']} responses, {stats['bytes'] / 2**20:.1f} MiB, "
+                  f"hits: {int(stats['hits'])}, misses: {int(stats['misses'])}, evictions: {int(stats['evictions'])}, "
+                  f"time saved: {stats['saved_seconds']:.1f}s")
+
+
+#
+# ===================================================================================================================
+#
+@commander.cli("price-added [SHELF] [--since=REF]")
+def price_added(shelf=None, since=None):
+    """ Sum up prices of entries added to the shelf since the last commit.
+
+Flags
+--------
+    --since=REF         Compare against a commit, or the last commit before a date like 2024-01-31.
+    """
+    from git import Repo, GitCommandError  # GitPython is slow to import, only this command needs it.
     repo = Repo(Path(config.home))
+    shelf_path = Path(config.home) / (shelf or '')
+    pathspec = str(shelf_path.relative_to(config.home)) or '.'
+
+    base = 'HEAD'
+    if since:
+        try:
+            base = repo.git.rev_parse('--verify', f'{since}^{{commit}}')
+        except GitCommandError:
+            if not (base := repo.git.rev_list('-1', f'--before={since}', 'HEAD')):
+                print(f"No commit found before {since}")
+                return -1
+
+    # Only ask git about the shelf, a repository wide status is slow on large collections.
+    added = repo.git.ls_files('--others', '--exclude-standard', '-z', '--', pathspec).split('\0')
+    if repo.head.is_valid():
+        added += repo.git.diff('--name-only', '--diff-filter=A', '-z', base, '--', pathspec).split('\0')
+
     books = []
-    for f in repo.untracked_files:
-        if f.startswith(shelf_path) and f.endswith('.bookshelf.metadata'):
-                with open(config.home + "/" + f, 'r') as book_data:
-                    book = json.load(book_data)
-                    book_path = Path(f).parents[0]
-                    books.append((book_path, book))
+    for f in sorted(set(added)):
+        if f.endswith(METADATA_NAME):
+            book = load_metadata(Path(config.home) / f)
+            if book.get('bookshelf_type') != 'bookshelf_metadata':
+                books.append((Path(config.home) / f, book))
 
     price_sum = 0
     for book_path, book_info in books:
+        plugin = find_plugin(fix_shelf_prefix(book_path.parent))
         price_sum += latest_price(book_info)
         plugin.print_metadata(book_info, only_title=False, multiples=1)
 
     print(f"Price total: {round(price_sum, 2)}")
 
 
+#
+# ===================================================================================================================
+#
+@commander.cli("serve")
+def serve():
+    """ Keep the collection in memory and answer ls and search from it until interrupted.
+
+While serving, ls and search run by the daemon instead, shelfs are only read again after inotify reported them changed.
+The daemon listens on the socket in the config, or BOOKSHELF_SOCKET, where the other commands look for it too.
+    """
+    global resident_shelfs
+    from .bookshelf_daemon import ResidentShelfs, serve_forever
+    if not config.socket:
+        print("No socket configured to serve on")
+        return -1
+    socket_path = Path(config.home) / config.socket
+    make_private_dir(socket_path)
+    try:
+        resident_shelfs = ResidentShelfs()
+    except OSError as e:
+        print(f"Could not watch for changes: {e}")
+        return -1
+    return serve_forever(socket_path, resident_shelfs, run_resident)
+
+
+def run_resident(argv):
+    """ Run a forwarded command line in this process, returns (exit code, output). """
+    output = io.StringIO()
+    argv_before = sys.argv
+    sys.argv = [argv_before[0], *argv]
+    try:
+        with contextlib.redirect_stdout(output):
+            try:
+                code = commander.call_with_help()
+            except SystemExit as e:
+                code = e.code
+    finally:
+        sys.argv = argv_before
+    return code, output.getvalue()
+
+
 #
 # ===================================================================================================================
 #
 @commander.cli("consolidate SHELF1 SHELF2")
 def consolidate(shelf1, shelf2):
-    src_books = {}
+    """ List entries of SHELF2 also found in SHELF1, sub-shelfs included. """
+    src_books = {unique_id for _book_path, _book, _plugin, unique_id in shelf_entries(shelf1)}
+    for _book_path, book, plugin, unique_id in shelf_entries(shelf2):
+        if unique_id in src_books:
+            plugin.print_metadata(book, only_title=False, multiples=1)
+
+
+#
+# ===================================================================================================================
+#
+@commander.cli("compare SHELFS [--difference] [--counts] [--reprint-group] [-t]")
+def compare(shelfs, difference=False, counts=False, reprint_group=False, t=False):
+    """ Compare shelfs by their entries, each shelf including its sub-shelfs.
+
+Lists the entries of the first shelf found in all the other shelfs.
+
+Flags
+--------
+    SHELFS              Comma separated shelfs, eg. mtg/binder,mtg/trade.
+    --difference        List entries of the first shelf found in none of the other shelfs instead.
+    --counts            Count every entry in each of the shelfs instead.
+    --reprint-group     Compare cards rather than printings, reprints count as the same entry.
+    -t                  Print only title not any extra metadata.
+    """
+    shelfs = [shelf for shelf in shelfs.split(',') if shelf]
+    edition = not reprint_group
+    if len(shelfs) < 2 and not counts:
+        print("Compare at least two shelfs.")
+        return -1
+
+    if counts:
+        # unique id -> (plugin, book, count in each shelf)
+        entry_counts = {}
+        for n, shelf in enumerate(shelfs):
+            for _book_path, book, plugin, unique_id in shelf_entries(shelf, edition):
+                if (entry := entry_counts.get(unique_id)) is None:
+                    entry = entry_counts[unique_id] = (plugin, book, [0] * len(shelfs))
+                entry[2][n] += 1
+
+        shelf_names = [fix_shelf_prefix(shelf) for shelf in shelfs]
+        print(' '.join(shelf_names))
+        for plugin, book, shelf_counts in sorted(entry_counts.values(), key=lambda e: e[0].get_title(e[1])):
+            print(' '.join(f"{count:>{len(name)}}" for name, count in zip(shelf_names, shelf_counts)), end='  ')
+            plugin.print_metadata(book, only_title=t, multiples=None)
+        return
+
+    # Hash the other shelfs once, counting how many have each entry, then stream the first shelf past them.
+    other_counts = {}
+    for shelf in shelfs[1:]:
+        unique_ids = {unique_id for _book_path, _book, _plugin, unique_id in shelf_entries(shelf, edition)}
+        for unique_id in unique_ids:
+            other_counts[unique_id] = other_counts.get(unique_id, 0) + 1
+
+    wanted = 0 if difference else len(shelfs) - 1
+    for book_path, book, plugin, unique_id in shelf_entries(shelfs[0], edition):
+        if other_counts.get(unique_id, 0) == wanted:
+            print(f"{fix_shelf_prefix(book_path.parents[0])} => ", end='')
+            plugin.print_metadata(book, only_title=t, multiples=None)
 
-    [(shelf_path, books, _)] = Bookshelf(shelf1, depth=None)
-    if plugin := find_plugin(fix_shelf_prefix(shelf_path)):
-        src_books = {plugin.get_unique_id(book) for _, book in books}
 
-    [(shelf_path, books, _)] = Bookshelf(shelf2, depth=None)
-    if plugin := find_plugin(fix_shelf_prefix(shelf_path)):
-        for _, book in books:
-            if plugin.get_unique_id(book) in src_books:
-                plugin.print_metadata(book, only_title=False, multiples=1)
+def shelf_entries(shelf, edition=True):
+    """ Stream (book_path, book, plugin, unique id) of the books in shelf and its sub-shelfs, by name within each
+    shelf. """
+    for shelf_path, books, _metadata in Bookshelf(shelf, depth=None):
+        if plugin := find_plugin(fix_shelf_prefix(shelf_path)):
+            for book_path, book in books:
+                yield book_path, book, plugin, plugin.get_unique_id(book, edition=edition)
@@ -1,3 +1,5 @@
+import os
+from functools import partial
 from pathlib import Path
 
 from .plugin_mtg import PluginMTG
@@ -5,13 +7,25 @@ from .plugin_mtg import PluginMTG
 
 
 class BookshelfConfig:
-    home = "/home/trez/lekplats/billy"
+    home = os.environ.get("BOOKSHELF_HOME", "/home/trez/lekplats/billy")
     new_entry = "folder"
+    # Files bookshelf keeps for itself go in a folder under home that git is told to ignore, see make_private_dir.
+    index = ".bookshelf/index"  # Metadata cache relative to home, None to always read the files.
+    jobs = 1  # Threads used to load metadata files, overridden by --jobs.
+    write_jobs = 8  # Threads used to write metadata files, overridden by --jobs.
+    # Unix socket of `bookshelf serve` relative to home, None to never use a daemon.
+    socket = os.environ.get("BOOKSHELF_SOCKET", ".bookshelf/sock")
+    # When price-update last checked each shelf, relative to home, None to not keep track.
+    price_checks = ".bookshelf/checked"
+    # Plugins are constructed on first use.
     shelfs = {
-        "mtg/": PluginMTG(
+        "mtg/": partial(
+            PluginMTG,
             currency='eur',
             foil_color='yellow',
             new_entry='file',
+            bulk_data_type='default_cards',  # Scryfall bulk file fetch-prices downloads, eg. 'all_cards'.
+            response_cache=Path(home) / ".bookshelf/responses",  # Cached api responses, None to always ask.
         )
     }
 
@@ -26,7 +40,28 @@ def fix_shelf_prefix(shelf):
     return fixed_shelf or '~root~'
 
 
+def make_private_dir(path):
+    """ Create the folder of a file bookshelf keeps for itself, with a .gitignore keeping it out of the collection. """
+    folder = Path(path).parent
+    if not folder.exists():
+        folder.mkdir(parents=True)
+        (folder / '.gitignore').write_text('*\n')
+
+
+plugins = {}
+
+
+def get_plugin(plugin_shelfs):
+    if (plugin := plugins.get(plugin_shelfs)) is None:
+        plugin = plugins[plugin_shelfs] = config.shelfs[plugin_shelfs]()
+    return plugin
+
+
+def all_plugins():
+    return [get_plugin(plugin_shelfs) for plugin_shelfs in config.shelfs]
+
+
 def find_plugin(shelf):
-    for plugin_shelfs, plugin in config.shelfs.items():
+    for plugin_shelfs in config.shelfs:
         if shelf.startswith(fix_shelf_prefix(plugin_shelfs)):
-            return plugin
+            return get_plugin(plugin_shelfs)
@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import errno
+import socket
+import struct
+import traceback
+
+# Commands a running daemon answers, anything else runs in the calling process.
+RESIDENT_COMMANDS = ['ls', 'search']
+
+# inotify(7) event bits.
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """ Directory watches through the Linux inotify api. """
+    def __init__(self):
+        import ctypes
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.get_errno = ctypes.get_errno
+        if (fd := self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)) < 0:
+            err = self.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.fd = fd
+        self.paths = {}
+        self.watches = {}
+
+    def watch(self, path):
+        path = str(path)
+        if path in self.paths:
+            return
+        if (wd := self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)) < 0:
+            if (err := self.get_errno()) not in (errno.ENOENT, errno.ENOTDIR):
+                raise OSError(err, os.strerror(err), path)
+            return
+        self.paths[path] = wd
+        self.watches[wd] = path
+
+    def read(self):
+        """ Watched directories changed since the last read, None if events were lost. """
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            pos = 0
+            while pos < len(data):
+                wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, pos)
+                pos += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if (path := self.watches.get(wd)) is not None:
+                    changed.add(path)
+                    if mask & IN_IGNORED:
+                        del self.watches[wd]
+                        self.paths.pop(path, None)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ResidentShelfs:
+    """ Shelf listings kept in memory, dropped as soon as inotify reports a change to them.
+
+    A listing is dropped along with its parent shelf's, which holds the metadata of sub-shelfs and folder entries.
+    """
+    def __init__(self):
+        self.inotify = Inotify()
+        self.listings = {}
+
+    def get(self, shelf_path):
+        return self.listings.get(str(shelf_path))
+
+    def put(self, shelf_path, listing):
+        self.listings[str(shelf_path)] = listing
+
+    def watch(self, *paths):
+        """ Watch paths before listing them, a change made while listing is then never missed.
+
+        Returns False when a path can't be watched, eg. past the inotify watch limit, its listing must then not be kept.
+        """
+        try:
+            for path in paths:
+                self.inotify.watch(path)
+        except OSError:
+            return False
+        return True
+
+    def refresh(self):
+        """ Drop listings of everything changed since the last refresh. """
+        if (changed := self.inotify.read()) is None:
+            self.listings.clear()
+            return
+        for path in changed:
+            self.listings.pop(path, None)
+            self.listings.pop(os.path.dirname(path), None)
+
+
+def serve_forever(socket_path, resident_shelfs, run_command):
+    """ Answer forwarded command lines on a Unix socket with run_command(argv) -> (exit code, output). """
+    import signal
+    import selectors
+    socket_path = str(socket_path)
+    if forward(socket_path, None)[0]:
+        print(f"Already serving on {socket_path}")
+        return -1
+    try:
+        os.unlink(socket_path)
+    except FileNotFoundError:
+        pass
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    server.listen()
+
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    selector.register(resident_shelfs.inotify.fd, selectors.EVENT_READ)
+    # Clean up the socket when stopped by a service manager as well.
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: sys.exit(0))
+    print(f"Serving on {socket_path}")
+    try:
+        while True:
+            for key, _events in selector.select():
+                # Changes are applied before every request, a client never sees what it changed itself go stale.
+                resident_shelfs.refresh()
+                if key.fileobj is server:
+                    connection, _address = server.accept()
+                    with connection:
+                        answer(connection, run_command)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        selector.close()
+        server.close()
+        resident_shelfs.inotify.close()
+        os.unlink(socket_path)
+
+
+def answer(connection, run_command):
+    try:
+        with connection.makefile('rb') as requests:
+            request = json.loads(requests.readline() or 'null')
+        if not request:
+            return
+        response = {'served': False}
+        if request['argv'] and request['argv'][0] in RESIDENT_COMMANDS:
+            try:
+                code, output = run_command(request['argv'])
+                response = {'served': True, 'exit': code, 'output': output}
+            except Exception:
+                # Whatever went wrong, the client runs the command itself and reports any error of its own.
+                traceback.print_exc()
+        connection.sendall(json.dumps(response).encode() + b'\n')
+    except (OSError, ValueError):
+        pass  # The client went away or spoke nonsense, keep serving the others.
+
+
+def forward(socket_path, argv):
+    """ Have the daemon on socket_path run argv, returns (served, exit code).
+
+    argv None only checks that a daemon answers. Nothing is served when no daemon is running.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(socket_path))
+        if argv is None:
+            return True, None
+        client.sendall(json.dumps({'argv': argv}).encode() + b'\n')
+        with client.makefile('rb') as responses:
+            response = json.loads(responses.readline() or 'null')
+    except (OSError, ValueError):
+        return False, None
+    finally:
+        client.close()
+
+    if not response or not response.get('served'):
+        return False, None
+    sys.stdout.write(response['output'])
+    if error := response.get('error'):
+        sys.stderr.write(error)
+    return True, response['exit']
@@ -1,5 +1,16 @@
 class NoPriceFoundError(Exception):
     pass
 
+
 class NoEntryFound(Exception):
     pass
+
+
+class InvalidQuery(Exception):
+    pass
+
+
+class AmbiguousEntry(Exception):
+    def __init__(self, candidates):
+        super().__init__(candidates)
+        self.candidates = candidates
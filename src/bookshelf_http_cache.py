@@ -0,0 +1,138 @@
+import json
+import time
+import sqlite3
+from pathlib import Path
+
+from .bookshelf_profile import profile
+
+DAY = 24 * 60 * 60
+
+# Seconds a response is served for, by the longest endpoint prefix matching. Prices change daily.
+DEFAULT_TTLS = {
+    '': DAY,
+    'cards/named': 7 * DAY,
+}
+
+
+class ResponseCache:
+    """ Persistent cache of JSON api responses keyed by method, endpoint and request parameters.
+
+    A response expires after the ttl of its endpoint, and the least recently used responses are
+    evicted once the cache grows over max_bytes. Hits, misses and the fetch time hits saved are
+    counted in the cache itself, so they add up over sessions.
+    """
+    schema_version = 1
+
+    def __init__(self, cache_path, max_bytes=64 * 2**20, ttls=None):
+        self.cache_path = Path(cache_path)
+        self.max_bytes = max_bytes
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.connection = None
+        self.disabled = False
+
+    def __connect(self):
+        from .bookshelf_config import make_private_dir  # The config imports the plugins using this cache.
+        make_private_dir(self.cache_path)
+        connection = sqlite3.connect(self.cache_path, timeout=10)
+        if connection.execute("PRAGMA user_version").fetchone()[0] != self.schema_version:
+            connection.executescript(f"""
+                DROP TABLE IF EXISTS responses;
+                DROP TABLE IF EXISTS stats;
+                CREATE TABLE responses (
+                    key TEXT PRIMARY KEY,
+                    body TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    fetched REAL NOT NULL,
+                    used REAL NOT NULL,
+                    fetch_seconds REAL NOT NULL
+                );
+                CREATE INDEX responses_used ON responses (used);
+                CREATE TABLE stats (name TEXT PRIMARY KEY, value REAL NOT NULL);
+                PRAGMA user_version = {self.schema_version};
+            """)
+        # Losing the last responses on a crash only means fetching them again.
+        connection.execute("PRAGMA synchronous = OFF")
+        return connection
+
+    def open(self):
+        if self.connection is None and not self.disabled:
+            try:
+                self.connection = self.__connect()
+            except sqlite3.DatabaseError:
+                # Corrupt or foreign file, start over.
+                try:
+                    self.cache_path.unlink()
+                    self.connection = self.__connect()
+                except (OSError, sqlite3.Error):
+                    self.disabled = True
+            except (OSError, sqlite3.Error):
+                self.disabled = True
+        return self.connection
+
+    def ttl(self, endpoint):
+        prefix = max((prefix for prefix in self.ttls if endpoint.startswith(prefix)), key=len, default=None)
+        return self.ttls[prefix] if prefix is not None else 0
+
+    def get(self, method, endpoint, request):
+        """ Cached response to the request, None when there is none or it expired. """
+        if not (connection := self.open()):
+            return None
+        key = request_key(method, endpoint, request)
+        now = time.time()
+        row = connection.execute("SELECT body, fetched, fetch_seconds FROM responses WHERE key = ?", (key,)).fetchone()
+        if row and now - row[1] < self.ttl(endpoint):
+            connection.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            self.__count(connection, hits=1, saved_seconds=row[2])
+            connection.commit()
+            profile.count('http_cache_hits')
+            return json.loads(row[0])
+
+        self.__count(connection, misses=1)
+        connection.commit()
+        profile.count('http_cache_misses')
+        return None
+
+    def put(self, method, endpoint, request, response, fetch_seconds):
+        if self.ttl(endpoint) <= 0 or not (connection := self.open()):
+            return
+        body = json.dumps(response, separators=(',', ':'))
+        now = time.time()
+        connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                           (request_key(method, endpoint, request), body, len(body), now, now, fetch_seconds))
+        self.__evict(connection)
+        connection.commit()
+
+    def __evict(self, connection):
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Make some room at once, not every following put has to evict.
+        evicted = []
+        for key, size in connection.execute("SELECT key, size FROM responses ORDER BY used"):
+            if total <= self.max_bytes * 0.9:
+                break
+            evicted.append((key,))
+            total -= size
+        connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.__count(connection, evictions=len(evicted))
+
+    def __count(self, connection, **counts):
+        connection.executemany("INSERT INTO stats VALUES (?, ?) "
+                               "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value", counts.items())
+
+    def stats(self):
+        """ Responses cached, their size and the counters so far. """
+        stats = {'responses': 0, 'bytes': 0, 'hits': 0, 'misses': 0, 'evictions': 0, 'saved_seconds': 0.0}
+        if connection := self.open():
+            stats['responses'], stats['bytes'] = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            stats.update(connection.execute("SELECT name, value FROM stats"))
+        return stats
+
+    def clear(self):
+        if connection := self.open():
+            connection.executescript("DELETE FROM responses; DELETE FROM stats;")
+
+
+def request_key(method, endpoint, request):
+    return json.dumps([method, endpoint, request], sort_keys=True, separators=(',', ':'))
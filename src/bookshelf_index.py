@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+from .bookshelf_config import make_private_dir
+from .bookshelf_profile import profile
+from .bookshelf_record import BookRecord, current_price
+
+METADATA_NAME = '.bookshelf.metadata'
+
+# Files modified this recently may still change without their mtime ticking,
+# they are cached but checked again next time.
+RACY_WINDOW_NS = 2 * 10**9
+
+# Lookup terms answered by the index, term -> (column, how the term value is stored).
+INDEXED_TERMS = {
+    'name': ('name', str.lower),
+    'oracle_id': ('oracle_id', str),
+    'set': ('set_code', str),
+    'collector_number': ('collector_number', str),
+}
+
+# Terms find can match, the indexed ones and further record columns, term -> (column, how the term value is stored).
+QUERY_TERMS = {
+    **INDEXED_TERMS,
+    'scryfall_id': ('scryfall_id', str),
+    'finish': ('finish', str),
+    'price': ('price', float),
+}
+
+# Columns a BookRecord is made from, in BookRecord.fields order.
+RECORD_COLUMNS = 'kind, title, oracle_id, scryfall_id, set_code, collector_number, finish, price'
+
+# Totals kept for every shelf's own books.
+SHELF_TOTALS = ['count', 'price', 'foils', 'foil_price']
+
+
+def metadata_dir(metadata_path):
+    """ Directory whose listing owns the metadata file, the shelf the entry lives in. """
+    metadata_path = Path(metadata_path)
+    if metadata_path.name == METADATA_NAME:
+        return str(metadata_path.parent.parent)
+    return str(metadata_path.parent)
+
+
+class MetadataIndex:
+    """ Persistent cache of parsed metadata files keyed by path, mtime and size.
+
+    The index lives in a SQLite database under the bookshelf home. A metadata file is only
+    read and parsed again when its mtime or size changed since it was cached. Entries are also
+    indexed by name, oracle id, set and collector number for lookups without parsing anything,
+    and every shelf keeps the totals of its books for as long as their stats are unchanged.
+    Entries keep what a BookRecord needs in columns of their own so listings never parse the data.
+    """
+    schema_version = 4
+
+    def __init__(self, index_path):
+        self.index_path = Path(index_path)
+        self.connection = None
+        self.disabled = False
+        self.dirty = False
+        # Metadata may be loaded from a thread pool, the connection is shared behind this lock.
+        self.lock = threading.RLock()
+
+    def __connect(self):
+        make_private_dir(self.index_path)
+        connection = sqlite3.connect(self.index_path, timeout=10, check_same_thread=False)
+        if connection.execute("PRAGMA user_version").fetchone()[0] != self.schema_version:
+            connection.executescript(f"""
+                DROP TABLE IF EXISTS files;
+                DROP TABLE IF EXISTS shelfs;
+                CREATE TABLE files (
+                    path TEXT PRIMARY KEY,
+                    dir TEXT NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    kind TEXT,
+                    name TEXT,
+                    oracle_id TEXT,
+                    set_code TEXT,
+                    collector_number TEXT,
+                    title TEXT,
+                    scryfall_id TEXT,
+                    finish TEXT,
+                    price REAL
+                );
+                CREATE INDEX files_dir ON files (dir);
+                CREATE INDEX files_name ON files (name);
+                CREATE INDEX files_oracle_id ON files (oracle_id);
+                CREATE INDEX files_set ON files (set_code, collector_number);
+                CREATE TABLE shelfs (
+                    path TEXT PRIMARY KEY,
+                    signature TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    price REAL NOT NULL,
+                    foils INTEGER NOT NULL,
+                    foil_price REAL NOT NULL
+                );
+                PRAGMA user_version = {self.schema_version};
+            """)
+        # It is only a cache, losing the last transaction on a crash is fine.
+        connection.execute("PRAGMA synchronous = OFF")
+        return connection
+
+    def open(self):
+        with self.lock:
+            if self.connection is None and not self.disabled:
+                try:
+                    self.connection = self.__connect()
+                except sqlite3.DatabaseError:
+                    # Corrupt or foreign file, start over.
+                    try:
+                        self.index_path.unlink()
+                        self.connection = self.__connect()
+                    except (OSError, sqlite3.Error):
+                        self.disabled = True
+                except (OSError, sqlite3.Error):
+                    self.disabled = True
+            return self.connection
+
+    def load(self, metadata_path, stat=None):
+        """ Parsed content of metadata_path, served from the index when the file is unchanged. """
+        path = str(metadata_path)
+        stat = stat or os.stat(path)
+        if not (connection := self.open()):
+            return read_metadata(path)
+
+        with self.lock:
+            row = connection.execute("SELECT mtime_ns, size, data FROM files WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            profile.count('index_hits')
+            return json.loads(row[2])
+        return self.__reindex(connection, path, stat)
+
+    def load_book(self, metadata_path, stat=None):
+        """ Like load, but entries come as compact BookRecords without parsing their data. """
+        path = str(metadata_path)
+        stat = stat or os.stat(path)
+        if not (connection := self.open()):
+            return read_metadata(path)
+
+        with self.lock:
+            row = connection.execute(f"SELECT mtime_ns, size, {RECORD_COLUMNS} FROM files WHERE path = ?",
+                                     (path,)).fetchone()
+        if row and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            if row[2] == 'bookshelf_metadata':
+                return self.load(path, stat)
+            profile.count('index_hits')
+            return BookRecord(path, *row[2:])
+        book = self.__reindex(connection, path, stat)
+        if book.get('bookshelf_type') == 'bookshelf_metadata':
+            return book
+        return BookRecord.from_dict(path, book)
+
+    def refresh(self, metadata_path, stat):
+        """ Bring the index up to date with metadata_path and return its bookshelf_type. """
+        path = str(metadata_path)
+        if not (connection := self.open()):
+            return read_metadata(path).get('bookshelf_type')
+
+        with self.lock:
+            row = connection.execute("SELECT mtime_ns, size, kind FROM files WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            profile.count('index_hits')
+            return row[2]
+        return self.__reindex(connection, path, stat).get('bookshelf_type')
+
+    def __reindex(self, connection, path, stat):
+        with open(path, 'r') as book_data:
+            data = book_data.read()
+        book = json.loads(data)
+        profile.count('files_parsed')
+        profile.count('bytes_read', stat.st_size)
+
+        # A racy file is stored as never matching, so it is read once more on its next use.
+        mtime_ns = stat.st_mtime_ns if time.time_ns() - stat.st_mtime_ns > RACY_WINDOW_NS else 0
+        terms = [to_column(book[term]) if book.get(term) is not None else None
+                 for term, (_column, to_column) in INDEXED_TERMS.items()]
+        with self.lock:
+            connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (path, metadata_dir(path), mtime_ns, stat.st_size, data, book.get('bookshelf_type'),
+                                *terms, book.get('name'), book.get('scryfall_id'), book.get('finish'),
+                                current_price(book)))
+            self.dirty = True
+        return book
+
+    def find(self, terms):
+        """ (path, BookRecord) of every indexed file matching all (term, op, value) terms, see QUERY_TERMS.
+
+        Values come converted like the column is stored. Ops are = (None matching a missing value), in with a list of
+        values, ~ for a column containing the value and the comparisons < <= > >=.
+        """
+        if not (connection := self.open()):
+            return []
+        clauses = []
+        values = []
+        for term, op, value in terms:
+            column = QUERY_TERMS[term][0]
+            if op == 'in':
+                clauses.append(f"{column} IN ({', '.join('?' * len(value))})")
+                values.extend(value)
+            elif value is None:
+                clauses.append(f"{column} IS NULL")
+            elif op == '~':
+                clauses.append(f"instr({column}, ?) > 0")
+                values.append(value)
+            else:
+                clauses.append(f"{column} {op} ?")
+                values.append(value)
+        where = ' AND '.join(clauses) or '1'
+        with self.lock:
+            rows = connection.execute(f"SELECT path, {RECORD_COLUMNS} FROM files WHERE {where}", values).fetchall()
+        return [(path, BookRecord(path, *columns)) for path, *columns in rows]
+
+    def shelf_totals(self, shelf_path, signature):
+        """ Cached totals of a shelf's books, see SHELF_TOTALS, or None unless cached for the same signature. """
+        if not (connection := self.open()):
+            return None
+        with self.lock:
+            row = connection.execute("SELECT signature, count, price, foils, foil_price FROM shelfs WHERE path = ?",
+                                     (str(shelf_path),)).fetchone()
+        if row and row[0] == signature:
+            profile.count('shelf_hits')
+            return dict(zip(SHELF_TOTALS, row[1:]))
+
+    def store_shelf_totals(self, shelf_path, signature, totals):
+        if not (connection := self.open()):
+            return
+        with self.lock:
+            connection.execute("INSERT OR REPLACE INTO shelfs VALUES (?, ?, ?, ?, ?, ?)",
+                               (str(shelf_path), signature, *(totals[total] for total in SHELF_TOTALS)))
+            self.dirty = True
+
+    def prune(self, dir_path, seen_paths):
+        """ Forget cached files listed under dir_path that were not seen in its latest listing. """
+        if not (connection := self.open()):
+            return
+        seen_paths = {str(p) for p in seen_paths}
+        with self.lock:
+            stale = [(path,) for (path,) in connection.execute("SELECT path FROM files WHERE dir = ?", (str(dir_path),))
+                     if path not in seen_paths]
+            if stale:
+                connection.executemany("DELETE FROM files WHERE path = ?", stale)
+                self.dirty = True
+
+    def commit(self):
+        with self.lock:
+            if self.connection is not None and self.dirty:
+                self.connection.commit()
+                self.dirty = False
+
+
+def read_metadata(metadata_path):
+    with open(metadata_path, 'rb') as book_data:
+        data = book_data.read()
+    profile.count('files_parsed')
+    profile.count('bytes_read', len(data))
+    return json.loads(data)
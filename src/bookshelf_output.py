@@ -0,0 +1,60 @@
+import sys
+import json
+
+from .bookshelf_profile import profile
+
+
+class Output:
+    """ Buffered listing output, as text or as one record per entry in jsonl or tsv.
+
+    Lines are collected and written to stdout in large chunks instead of one print per entry,
+    headers and summaries only go into text output so records can be piped straight into other tools.
+    """
+    formats = ['text', 'jsonl', 'tsv']
+    buffer_lines = 4096
+
+    def __init__(self, output_format=None, relative_path=str):
+        self.format = output_format or 'text'
+        self.relative_path = relative_path
+        self.lines = []
+        self.columns = None
+
+    def text(self, line):
+        """ Add a line only meant for people, left out of records. """
+        if self.format == 'text':
+            self.__add(line)
+
+    def entry(self, plugin, book, book_path, only_title=False, multiples=None, prefix=''):
+        """ Add an entry, as prefix followed by the plugin's metadata string in text. """
+        with profile.phase('format'):
+            if self.format == 'text':
+                self.__add(prefix + plugin.metadata_stringify(book, only_title, multiples))
+                return
+
+            record = {'path': self.relative_path(book_path), **plugin.metadata_row(book), 'count': multiples or 1}
+            if self.format == 'jsonl':
+                self.__add(json.dumps(record, ensure_ascii=False))
+            else:
+                if self.columns is None:
+                    self.columns = list(record)
+                    self.__add('\t'.join(self.columns))
+                self.__add('\t'.join(tsv_value(record.get(column)) for column in self.columns))
+
+    def __add(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.buffer_lines:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            with profile.phase('output'):
+                # Looked up on every flush, the daemon captures stdout per request.
+                sys.stdout.write('\n'.join(self.lines) + '\n')
+                sys.stdout.flush()
+            self.lines = []
+
+
+def tsv_value(value):
+    if value is None:
+        return ''
+    return str(value).replace('\t', ' ').replace('\n', ' ')
@@ -0,0 +1,102 @@
+import sys
+import json
+import time
+import threading
+import contextlib
+
+# Shared by every disabled phase, entering it does nothing.
+NO_PHASE = contextlib.nullcontext()
+
+
+class Phase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+
+
+class Profiler:
+    """ Per phase timers and counters, enabled with --profile[=MODE] or BOOKSHELF_PROFILE=MODE.
+
+    MODE is summary (default), json, or cprofile[:FILE] to also run under cProfile and either print the
+    top functions or dump the stats to FILE. Hooks check enabled first so they cost next to nothing
+    when profiling is off. Phase times are inclusive, a phase nested in another counts towards both.
+    """
+    modes = ['summary', 'json', 'cprofile']
+
+    def __init__(self):
+        self.enabled = False
+        self.timers = {}
+        self.counters = {}
+        # Metadata may be loaded from a thread pool.
+        self.lock = threading.Lock()
+
+    def phase(self, name):
+        if not self.enabled:
+            return NO_PHASE
+        return Phase(self, name)
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            timer = self.timers.setdefault(name, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += 1
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def run(self, fun, mode):
+        """ Call fun with profiling enabled and report to stderr when it is done. """
+        mode, _, stats_path = mode.partition(':')
+        if mode not in self.modes:
+            print(f"Unknown profile mode {mode}, use one of {', '.join(self.modes)}", file=sys.stderr)
+            mode = 'summary'
+
+        self.enabled = True
+        profiler = None
+        if mode == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+        command = ' '.join(sys.argv[1:2]) or '-'
+        start = time.perf_counter()
+        try:
+            return profiler.runcall(fun) if profiler else fun()
+        finally:
+            wall = time.perf_counter() - start
+            self.enabled = False
+            if mode == 'json':
+                print(json.dumps(self.report(command, wall)), file=sys.stderr)
+            else:
+                self.print_summary(command, wall)
+            if profiler and stats_path:
+                profiler.dump_stats(stats_path)
+                print(f"cProfile stats written to {stats_path}", file=sys.stderr)
+            elif profiler:
+                import pstats
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+
+    def report(self, command, wall):
+        return {
+            'command': command,
+            'wall_s': round(wall, 6),
+            'phases': {name: {'seconds': round(seconds, 6), 'calls': calls}
+                       for name, (seconds, calls) in self.timers.items()},
+            'counters': dict(self.counters),
+        }
+
+    def print_summary(self, command, wall):
+        print(f"Profile of {command}: {wall:.3f}s", file=sys.stderr)
+        for name, (seconds, calls) in sorted(self.timers.items(), key=lambda t: -t[1][0]):
+            print(f"  {name:16} {seconds:10.3f}s {calls:10} calls", file=sys.stderr)
+        for name, value in sorted(self.counters.items()):
+            print(f"  {name:16} {value:11}", file=sys.stderr)
+
+
+profile = Profiler()
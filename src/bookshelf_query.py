@@ -0,0 +1,203 @@
+import re
+import operator
+
+from .bookshelf_errors import InvalidQuery
+from .bookshelf_index import QUERY_TERMS
+from .bookshelf_record import current_price
+
+TOKENS = re.compile(r"""\s*(?:
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+    |(?P<op>!=|<=|>=|[=~<>(),])
+    |(?P<word>[^\s"'=!<>~(),]+)
+)""", re.VERBOSE)
+KEYWORDS = ['and', 'or', 'not', 'in']
+RANGES = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+RANGE_TERMS = ['price']
+
+
+class Query:
+    """ Filter expression compiled into a single predicate on books, eg.
+
+        name~"bolt" and price>5 and set in (lea, leb) and finish=foil
+
+    Terms compare a field, one of QUERY_TERMS, with = != ~ (contains, ignoring case), `in (...)` and,
+    for price, < <= > >=. `=` ignores case for name like the index does, and an unquoted none stands
+    for a missing value, eg. finish=none. Terms combine with and, or, not and parentheses.
+
+    Extra terms given as (field, op, value) are and:ed with the expression. The terms all books must
+    match are kept in index_terms, for narrowing them down in the index before any book is loaded.
+    """
+    def __init__(self, expression=None, terms=()):
+        conjuncts = [('term', *check_term(*term)) for term in terms]
+        if expression:
+            conjuncts.extend(conjunction(Parser(expression).parse()))
+        self.expression = expression
+        self.empty = not conjuncts
+        self.index_terms = [node[1:] for node in conjuncts if node[0] == 'term' and pushable(*node[1:3])]
+        self.predicate = compile_node(('and', conjuncts))
+
+
+class Parser:
+    """ Recursive descent over the tokens, building a tree of ('and'|'or', nodes), ('not', node)
+    and ('term', field, op, value) nodes. """
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.position = 0
+
+    def parse(self):
+        node = self.__or()
+        if self.position < len(self.tokens):
+            raise InvalidQuery(f"Unexpected {self.tokens[self.position][1]!r} in query {self.expression!r}")
+        return node
+
+    def __peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def __next(self, expected=None):
+        kind, text = self.__peek()
+        if kind is None:
+            raise InvalidQuery(f"Query {self.expression!r} ends too early")
+        if expected is not None and text != expected:
+            raise InvalidQuery(f"Expected {expected!r} but got {text!r} in query {self.expression!r}")
+        self.position += 1
+        return kind, text
+
+    def __or(self):
+        nodes = [self.__and()]
+        while self.__peek() == ('keyword', 'or'):
+            self.__next()
+            nodes.append(self.__and())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def __and(self):
+        nodes = [self.__not()]
+        while self.__peek() == ('keyword', 'and'):
+            self.__next()
+            nodes.append(self.__not())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def __not(self):
+        if self.__peek() == ('keyword', 'not'):
+            self.__next()
+            return ('not', self.__not())
+        if self.__peek() == ('op', '('):
+            self.__next()
+            node = self.__or()
+            self.__next(')')
+            return node
+        return self.__term()
+
+    def __term(self):
+        kind, field = self.__next()
+        if kind != 'word':
+            raise InvalidQuery(f"Expected a field but got {field!r} in query {self.expression!r}")
+        kind, op = self.__next()
+        if (kind, op) == ('keyword', 'in'):
+            self.__next('(')
+            values = [self.__value()[1]]
+            while self.__peek() == ('op', ','):
+                self.__next()
+                values.append(self.__value()[1])
+            self.__next(')')
+            return ('term', *check_term(field, 'in', values))
+        if kind != 'op' or op not in ('=', '!=', '~', *RANGES):
+            raise InvalidQuery(f"Expected a comparison after {field!r} but got {op!r} in query {self.expression!r}")
+        value = self.__value()
+        if value == ('word', 'none') and op in ('=', '!='):
+            return ('term', *check_term(field, op, None))
+        return ('term', *check_term(field, op, value[1]))
+
+    def __value(self):
+        kind, text = self.__next()
+        if kind == 'string':
+            return kind, re.sub(r'\\(.)', r'\1', text[1:-1])
+        if kind != 'word':
+            raise InvalidQuery(f"Expected a value but got {text!r} in query {self.expression!r}")
+        return kind, text
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        if not (match := TOKENS.match(expression, position)):
+            raise InvalidQuery(f"Can't read query {expression!r} from {expression[position:]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        text = match[kind]
+        if kind == 'word' and text.lower() in KEYWORDS:
+            kind, text = 'keyword', text.lower()
+        tokens.append((kind, text))
+    return tokens
+
+
+def check_term(field, op, value):
+    """ The term with its value converted the way the index stores it, InvalidQuery when it makes no sense. """
+    if field not in QUERY_TERMS:
+        raise InvalidQuery(f"Unknown field {field!r}, use one of {', '.join(QUERY_TERMS)}")
+    if op in RANGES and field not in RANGE_TERMS:
+        raise InvalidQuery(f"Only {', '.join(RANGE_TERMS)} can be compared with {op}")
+    to_column = QUERY_TERMS[field][1]
+    try:
+        if op == 'in':
+            return field, op, [to_column(v) for v in value]
+        if op == '~':
+            return field, op, str(value).lower()
+        return field, op, None if value is None else to_column(value)
+    except ValueError:
+        raise InvalidQuery(f"{value!r} is not a valid {field}") from None
+
+
+def pushable(field, op):
+    """ Whether MetadataIndex.find answers the term exactly like the predicate does. """
+    if op == '~':
+        # Only names are stored lowercase.
+        return field == 'name'
+    return op != '!='
+
+
+def conjunction(node):
+    """ Terms a node requires all of. """
+    return node[1] if node[0] == 'and' else [node]
+
+
+def getter(field):
+    if field == 'price':
+        return current_price
+    return lambda book: book.get(field)
+
+
+def compile_node(node):
+    """ Turn a query tree into one function of a book, choosing everything that can be up front. """
+    if node[0] == 'and':
+        functions = [compile_node(child) for child in node[1]]
+        if len(functions) == 1:
+            return functions[0]
+        return lambda book: all(function(book) for function in functions)
+    if node[0] == 'or':
+        functions = [compile_node(child) for child in node[1]]
+        return lambda book: any(function(book) for function in functions)
+    if node[0] == 'not':
+        function = compile_node(node[1])
+        return lambda book: not function(book)
+
+    _term, field, op, value = node
+    get = getter(field)
+    to_column = QUERY_TERMS[field][1]
+    if op in ('=', '!='):
+        if value is None:
+            def equals(book):
+                return get(book) is None
+        else:
+            def equals(book):
+                return (x := get(book)) is not None and to_column(x) == value
+        return equals if op == '=' else lambda book: not equals(book)
+    if op == 'in':
+        values = frozenset(value)
+        return lambda book: (x := get(book)) is not None and to_column(x) in values
+    if op == '~':
+        return lambda book: (x := get(book)) is not None and value in str(x).lower()
+    compare = RANGES[op]
+    return lambda book: (x := get(book)) is not None and compare(x, value)
@@ -0,0 +1,73 @@
+import sys
+
+
+class BookRecord:
+    """ Compact entry holding only the fields listings need, the metadata file is read when anything else is asked for.
+
+    Reads like the metadata dict, book['price_history'] or setting a field loads the whole file once and keeps it,
+    so dict(book) is the complete content to write back. A field that is None counts as missing for `in`.
+    """
+    fields = ('bookshelf_type', 'name', 'oracle_id', 'scryfall_id', 'set', 'collector_number', 'finish', 'price')
+    __slots__ = ('metadata_path', 'full', *fields)
+
+    def __init__(self, metadata_path, bookshelf_type, name, oracle_id, scryfall_id, setcode, collector_number, finish,
+                 price):
+        self.metadata_path = metadata_path
+        self.full = None
+        self.bookshelf_type = bookshelf_type and sys.intern(bookshelf_type)
+        self.name = name and sys.intern(name)
+        self.oracle_id = oracle_id
+        self.scryfall_id = scryfall_id
+        self.set = setcode and sys.intern(setcode)
+        self.collector_number = collector_number
+        self.finish = finish and sys.intern(finish)
+        self.price = price
+
+    @classmethod
+    def from_dict(cls, metadata_path, book):
+        return cls(metadata_path, *(book.get(field) for field in cls.fields[:-1]), current_price(book))
+
+    def metadata(self):
+        """ The whole metadata dict, read from the file on first use. """
+        if self.full is None:
+            from .bookshelf_index import read_metadata
+            self.full = read_metadata(self.metadata_path)
+        return self.full
+
+    def __getitem__(self, key):
+        if key in BookRecord.fields and (value := getattr(self, key)) is not None:
+            return value
+        return self.metadata()[key]
+
+    def get(self, key, default=None):
+        if key in BookRecord.fields:
+            value = getattr(self, key)
+            return default if value is None else value
+        return self.metadata().get(key, default)
+
+    def __contains__(self, key):
+        if key in BookRecord.fields:
+            return getattr(self, key) is not None
+        return key in self.metadata()
+
+    def __setitem__(self, key, value):
+        self.metadata()[key] = value
+        if key in BookRecord.fields:
+            setattr(self, key, value)
+
+    def keys(self):
+        return self.metadata().keys()
+
+    def __iter__(self):
+        return iter(self.metadata())
+
+    def __len__(self):
+        return len(self.metadata())
+
+
+def current_price(book):
+    """ Cached price of a metadata dict, or the last one in its history. """
+    if (price := book.get('price')) is not None:
+        return price
+    if price_history := book.get('price_history'):
+        return price_history[-1].get('price')
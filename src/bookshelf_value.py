@@ -0,0 +1,52 @@
+import numpy as np
+
+BUCKETS = ['day', 'week', 'month']
+
+
+def bucket_bounds(first_day, last_day, bucket):
+    """ Start and end (exclusive) days of the buckets covering first_day to last_day. """
+    if bucket == 'month':
+        months = np.arange(first_day.astype('datetime64[M]'), last_day.astype('datetime64[M]') + 1)
+        return months.astype('datetime64[D]'), (months + 1).astype('datetime64[D]')
+    if bucket == 'week':
+        # Day 0 of datetime64 is a Thursday, weeks start on Monday.
+        first_day = first_day - (first_day.astype(np.int64) - 4) % 7
+        starts = np.arange(first_day, last_day + 1, 7)
+        return starts, starts + 7
+    starts = np.arange(first_day, last_day + 1)
+    return starts, starts + 1
+
+
+def value_series(shelf_numbers, days, prices, book_starts, shelf_count, bucket='month', since=None, until=None):
+    """ Value of every shelf at the end of each bucket, as of the latest price each entry had by then.
+
+    Price histories come flattened in history order: the shelf number, ISO day and price (None when
+    missing) of every history entry, with book_starts holding the position of each book's first entry.
+    Returns (bucket labels, values) with values shaped [shelf, bucket].
+
+    Each entry contributes the change from its book's previous price on its day, so the value series is
+    a cumulative sum of those changes bucketed by day, no per book join is needed.
+    """
+    days = np.asarray(days, dtype='datetime64[D]')
+    first_day = np.datetime64(since, 'D') if since else (days.min() if len(days) else np.datetime64('today', 'D'))
+    last_day = np.datetime64(until, 'D') if until else max(days.max(initial=first_day), np.datetime64('today', 'D'))
+    starts, ends = bucket_bounds(first_day, last_day, bucket)
+    if not len(days):
+        return starts.astype(str), np.zeros((shelf_count, len(starts)))
+
+    shelf_numbers = np.asarray(shelf_numbers, dtype=np.intp)
+    prices = np.asarray(prices, dtype=float)
+    first = np.zeros(len(prices), dtype=bool)
+    first[np.asarray(book_starts, dtype=np.intp)] = True
+
+    # A missing price keeps the one before it, carried forward within the book only.
+    positions = np.arange(len(prices))
+    last_known = np.maximum.accumulate(np.where(~np.isnan(prices) | first, positions, 0))
+    filled = np.nan_to_num(prices[last_known])
+    changes = filled - np.where(first, 0.0, np.concatenate(([0.0], filled[:-1])))
+
+    # Bucket of an entry is the first one ending after its day, those after the last bucket are left out.
+    bucket_numbers = np.searchsorted(ends, days, side='right')
+    width = len(starts) + 1
+    totals = np.bincount(shelf_numbers * width + bucket_numbers, weights=changes, minlength=shelf_count * width)
+    return starts.astype(str), totals.reshape(shelf_count, width)[:, :-1].cumsum(axis=1)
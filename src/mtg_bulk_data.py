@@ -0,0 +1,146 @@
+import os
+import json
+import zlib
+from pathlib import Path
+
+from .bookshelf_profile import profile
+
+CHUNK_SIZE = 2**20
+GZIP_MAGIC = b'\x1f\x8b'
+TIMEOUT = 60
+
+
+class BulkData:
+    """ A Scryfall bulk data file on disk, downloaded again only when the snapshot changed.
+
+    What identifies the downloaded snapshot is kept next to the file in <file>.fetch, the next fetch
+    asks the server with If-None-Match and If-Modified-Since and gets nothing back when unchanged.
+    Downloads are streamed to <file>.part as sent, still gzip encoded, so an interrupted download can be
+    continued with a Range request as long as the server has the same snapshot. The file itself is only
+    replaced once the whole snapshot is in, decoded on the way.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.part_path = Path(f"{path}.part")
+        self.state_path = Path(f"{path}.fetch")
+
+    def state(self):
+        try:
+            return json.loads(self.state_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def __save_state(self, state):
+        tmp_path = Path(f"{self.state_path}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(state, indent=2))
+        os.replace(tmp_path, self.state_path)
+
+    def __fetched(self, state):
+        """ Whether the file on disk is the snapshot the state describes. """
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return False
+        return state.get('size') == stat.st_size and state.get('mtime_ns') == stat.st_mtime_ns
+
+    def snapshot(self):
+        """ Identifies the snapshot on disk, by when it was published if it was fetched. None without a file. """
+        state = self.state()
+        if self.__fetched(state):
+            return state.get('updated_at') or state.get('etag') or state.get('last_modified')
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def fetch(self, session, url, updated_at=None, force=False):
+        """ Download url unless the snapshot on disk is the same, returns whether a new one was downloaded.
+
+        updated_at is when the snapshot at url was published, if known up front, with it an unchanged
+        snapshot is skipped without even asking for the file.
+        """
+        state = self.state()
+        fetched = not force and self.__fetched(state)
+        if fetched and updated_at and state.get('updated_at') == updated_at:
+            return False
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        headers = {'Accept': '*/*', 'Accept-Encoding': 'gzip'}
+        if fetched and state.get('url') == url:
+            if etag := state.get('etag'):
+                headers['If-None-Match'] = etag
+            if last_modified := state.get('last_modified'):
+                headers['If-Modified-Since'] = last_modified
+
+        partial = state.get('partial') or {}
+        offset = self.part_path.stat().st_size if self.part_path.exists() else 0
+        if offset and partial.get('url') == url and (validator := if_range(partial)):
+            headers['Range'] = f"bytes={offset}-"
+            headers['If-Range'] = validator
+
+        with profile.phase('http'):
+            response = session.get(url, headers=headers, stream=True, timeout=TIMEOUT)
+        profile.count('http_requests')
+        with response:
+            if response.status_code == 304:
+                state['updated_at'] = updated_at or state.get('updated_at')
+                self.__save_state(state)
+                return False
+            if response.status_code == 416:
+                # The part is no beginning of what the server has, start over.
+                self.part_path.unlink(missing_ok=True)
+                state.pop('partial', None)
+                self.__save_state(state)
+                return self.fetch(session, url, updated_at, force)
+            response.raise_for_status()
+
+            validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+            if response.status_code != 206:
+                offset = 0
+                state['partial'] = {'url': url, **validators}
+                self.__save_state(state)
+            from urllib3.exceptions import HTTPError  # Comes with requests, raised by the raw stream.
+            with open(self.part_path, 'r+b' if offset else 'wb') as part, profile.phase('http'):
+                part.seek(offset)
+                part.truncate()
+                try:
+                    for chunk in response.raw.stream(CHUNK_SIZE, decode_content=False):
+                        part.write(chunk)
+                        profile.count('bytes_downloaded', len(chunk))
+                except HTTPError as e:
+                    raise OSError(f"Download broke off after {part.tell()} bytes, fetch again to continue: {e}") from e
+
+        self.__install()
+        stat = self.path.stat()
+        self.__save_state({'url': url, 'updated_at': updated_at, **validators,
+                           'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+        return True
+
+    def __install(self):
+        """ Move the complete download into place, gunzipping it when it came gzip encoded. """
+        with open(self.part_path, 'rb') as part:
+            if part.read(2) != GZIP_MAGIC:
+                os.replace(self.part_path, self.path)
+                return
+            part.seek(0)
+            tmp_path = Path(f"{self.path}.{os.getpid()}.tmp")
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            try:
+                with open(tmp_path, 'wb') as decoded:
+                    while chunk := part.read(CHUNK_SIZE):
+                        decoded.write(decompressor.decompress(chunk))
+                    decoded.write(decompressor.flush())
+            except zlib.error as e:
+                tmp_path.unlink(missing_ok=True)
+                self.part_path.unlink(missing_ok=True)
+                raise OSError(f"Corrupt download of {self.path}: {e}") from e
+        os.replace(tmp_path, self.path)
+        self.part_path.unlink()
+
+
+def if_range(validators):
+    """ Validator for If-Range, weak etags may not be used there. """
+    if (etag := validators.get('etag')) and not etag.startswith('W/'):
+        return etag
+    return validators.get('last_modified')
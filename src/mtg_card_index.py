@@ -0,0 +1,101 @@
+import os
+import json
+import sqlite3
+from pathlib import Path
+
+
+class CardIndex:
+    """ Offline card lookups built from a Scryfall bulk data file.
+
+    Maps exact names to oracle ids, oracle ids to printings ordered by release and
+    set#collector_number to a single card, holding only what the plugin needs of each card.
+    """
+    schema_version = 1
+    card_fields = ['id', 'oracle_id', 'name', 'set', 'collector_number', 'released_at']
+
+    def __init__(self, index_path):
+        self.index_path = Path(index_path)
+        self.connection = None
+
+    def build(self, cards):
+        """ Write a new index from an iterable of Scryfall card objects, replacing the old one. """
+        tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+        tmp_path.unlink(missing_ok=True)
+        connection = sqlite3.connect(tmp_path)
+        connection.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE cards (
+                id TEXT PRIMARY KEY,
+                oracle_id TEXT,
+                name TEXT,
+                "set" TEXT,
+                collector_number TEXT,
+                released_at TEXT,
+                prices TEXT
+            );
+            CREATE TABLE names (name TEXT NOT NULL, oracle_id TEXT NOT NULL, PRIMARY KEY (name, oracle_id));
+        """)
+
+        count = 0
+        for card in cards:
+            # Lookups are done in english like the /en api endpoint.
+            if card.get('object', 'card') != 'card' or card.get('lang', 'en') != 'en':
+                continue
+            if not (oracle_id := card.get('oracle_id')):
+                continue
+            connection.execute("INSERT OR REPLACE INTO cards VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               [card.get(field) for field in self.card_fields] + [json.dumps(card.get('prices', {}))])
+            names = {card['name'].lower(), *(face.strip().lower() for face in card['name'].split('//'))}
+            connection.executemany("INSERT OR IGNORE INTO names VALUES (?, ?)", [(name, oracle_id) for name in names])
+            count += 1
+
+        connection.executescript(f"""
+            CREATE INDEX cards_oracle ON cards (oracle_id, released_at);
+            CREATE INDEX cards_set ON cards ("set", collector_number);
+            PRAGMA user_version = {self.schema_version};
+        """)
+        connection.commit()
+        connection.close()
+
+        self.close()
+        os.replace(tmp_path, self.index_path)
+        return count
+
+    def open(self):
+        if self.connection is None and self.index_path.exists():
+            connection = sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True)
+            if connection.execute("PRAGMA user_version").fetchone()[0] == self.schema_version:
+                self.connection = connection
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def oracle_id(self, name):
+        if connection := self.open():
+            if row := connection.execute("SELECT oracle_id FROM names WHERE name = ?", (name.lower(),)).fetchone():
+                return row[0]
+
+    def printings(self, oracle_id):
+        """ Printings of a card, newest release first like Scryfall's order=released. """
+        if connection := self.open():
+            rows = connection.execute(f"SELECT {self.__columns()} FROM cards WHERE oracle_id = ? "
+                                      "ORDER BY released_at DESC, \"set\", collector_number", (oracle_id,))
+            return [self.__card(row) for row in rows]
+
+    def card(self, setcode, collector_number):
+        if connection := self.open():
+            row = connection.execute(f"SELECT {self.__columns()} FROM cards WHERE \"set\" = ? AND collector_number = ?",
+                                     (setcode.lower(), collector_number)).fetchone()
+            return row and self.__card(row)
+
+    def __columns(self):
+        return ', '.join(f'"{field}"' for field in self.card_fields + ['prices'])
+
+    def __card(self, row):
+        card = dict(zip(self.card_fields, row))
+        card['prices'] = json.loads(row[-1])
+        return card
@@ -1,7 +1,36 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+
+
+def compact_price_history(price_history, downsample_after=None, now=None):
+    """ Drop prices repeating the one before, and keep only the last price of each month for
+    entries older than downsample_after days. """
+    cutoff = None
+    if downsample_after is not None:
+        cutoff = ((now or datetime.now()) - timedelta(days=downsample_after)).isoformat()
+
+    compacted = []
+    for price_entry in price_history:
+        if compacted:
+            last = compacted[-1]
+            if same_price(last, price_entry):
+                continue
+            # ISO timestamps compare and bucket fine as plain strings.
+            if cutoff and price_entry['date'] < cutoff and last['date'][:7] == price_entry['date'][:7]:
+                compacted[-1] = price_entry
+                continue
+        compacted.append(price_entry)
+    # Keeping the last price of a month can bring back the price of the month before.
+    return [price_entry for i, price_entry in enumerate(compacted)
+            if i == 0 or not same_price(compacted[i - 1], price_entry)]
+
+
+def same_price(price_entry, other):
+    return price_entry['price'] == other['price'] and price_entry.get('currency') == other.get('currency')
 
 
 class PluginBase:
+    compact_history = False
+    downsample_history_after = None
 
     def __init__(self):
         pass
@@ -9,3 +38,19 @@ class PluginBase:
     def get_timestamp(self):
         my_date = datetime.now()
         return my_date.isoformat() + 'Z'
+
+    def bulk_data_snapshot(self):
+        """ Identifies the price data price_update reads, None when there is nothing to tell snapshots apart by. """
+        return None
+
+    def metadata_row(self, metadata_json):
+        """ Fields of an entry for machine readable listings. """
+        return {'name': metadata_json.get('name'), 'price': metadata_json.get('price')}
+
+    def append_price(self, metadata_json, price_entry):
+        """ Add a price to the history, keeping the cached current price in sync. """
+        metadata_json['price_history'].append(price_entry)
+        if self.compact_history:
+            metadata_json['price_history'] = compact_price_history(metadata_json['price_history'],
+                                                                   self.downsample_history_after)
+        metadata_json['price'] = metadata_json['price_history'][-1]['price']
@@ -1,12 +1,16 @@
-import requests
 from pathlib import Path
-import sys
+import re
+import time
 import json
 from enum import Enum
-import colors as pycolors
 
 from .plugin_base import PluginBase
-from .bookshelf_errors import NoPriceFoundError, NoEntryFound
+from .bookshelf_profile import profile
+from .bookshelf_record import current_price
+from .mtg_card_index import CardIndex
+from .mtg_bulk_data import BulkData, TIMEOUT
+from .bookshelf_http_cache import ResponseCache
+from .bookshelf_errors import NoPriceFoundError, NoEntryFound, AmbiguousEntry
 
 set_set = {"Urza's Saga": 'usg', "Urza's Destiny": 'uds', '7th Edition': '7ed', 'Exodus': 'exo', 'Classic 6th Edition': '6ed', 
            'Limited Edition Beta': 'leb', 'Fallen Empires': 'fem', 'Alliances': 'all', 'Planeshift': 'pls', 'Mirrodin': 'mrd',
@@ -19,17 +23,147 @@ set_set = {"Urza's Saga": 'usg', "Urza's Destiny": 'uds', '7th Edition': '7ed',
            'Stronghold': 'sth', 'Scourge': 'scg', 'Onslaught': 'ons', 'Weatherlight': 'wth', 'Mirage': 'mir', 'Arabian Nights': 'arn',
            'Time Spiral Timeshifted': 'tsb', 'Betrayers of Kamigawa': 'bok', 'Odyssey': 'ody', 'Revised Edition': '3ed', 'Time Spiral': 'tsp'}
 
+JSON_WHITESPACE = re.compile(r'\s*')
+
+
+def iter_json_array(fp, chunk_size=2**20):
+    """ Yield the elements of a top level JSON array one by one, reading fp in chunks. """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    expect = '['  # Then 'first', after which 'separator' and 'element' take turns.
+    while True:
+        pos = JSON_WHITESPACE.match(buffer, pos).end()
+        if pos < len(buffer):
+            char = buffer[pos]
+            if expect == '[':
+                if char != '[':
+                    raise ValueError("Expected a JSON array")
+                expect, pos = 'first', pos + 1
+                continue
+            if char == ']' and expect in ('first', 'separator'):
+                return
+            if expect == 'separator':
+                if char != ',':
+                    raise ValueError(f"Expected , or ] in JSON array, got {char!r}")
+                expect, pos = 'element', pos + 1
+                continue
+
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+                # A number cut off by the chunk decodes short, an element is only whole once , or ] follows.
+                after = JSON_WHITESPACE.match(buffer, end).end()
+                complete = eof or (after < len(buffer) and buffer[after] in ',]')
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if complete:
+                yield element
+                expect, pos = 'separator', end
+                continue
+        elif eof:
+            raise ValueError("Unexpected end of JSON array")
+
+        # Element continues in the next chunk, keep only the unconsumed tail.
+        chunk = fp.read(chunk_size)
+        buffer, pos = buffer[pos:] + chunk, 0
+        eof = not chunk
+
+
+# Decklist line, eg. "4 Lightning Bolt (2XM) 129 *F*". Count, set, collector number and finish are optional.
+ENTRY_LIST_LINE = re.compile(r'^(?:(?P<times>\d+)x?\s+)?(?P<name>.+?)'
+                             r'(?:\s+\((?P<set>[^)\s]+)\)(?:\s+(?P<collector_number>\S+))?)?'
+                             r'(?:\s+\*(?P<finish>[FE])\*)?$')
+ENTRY_LIST_FINISHES = {'F': 'foil', 'E': 'etched'}
+
+
+class RateLimiter:
+    """ Space out calls by at least interval seconds. """
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_call = 0.0
+
+    def wait(self):
+        now = time.monotonic()
+        if self.next_call > now:
+            time.sleep(self.next_call - now)
+        self.next_call = max(now, self.next_call) + self.interval
+
+
 class MTGCardFinish(str, Enum):
     FOIL = "foil"
     ETCHED = "etched"
 
 
 class PluginMTG(PluginBase):
-    def __init__(self, currency, foil_color=None, new_entry=None):
+    # Scryfall accepts at most this many identifiers per /cards/collection request.
+    collection_batch_size = 75
+
+    def __init__(self, currency, foil_color=None, new_entry=None, api_url="https://api.scryfall.com",
+                 request_interval=0.1, bulk_data="resources/cards.json", card_index="resources/cards.index",
+                 compact_history=False, downsample_history_after=None, response_cache=None,
+                 response_cache_size=64 * 2**20, response_ttls=None, bulk_data_type="default_cards",
+                 bulk_data_url=None):
         self.currency = currency
         self.foil_color = foil_color
         self.version = '1.0'
         self.new_entry = new_entry
+        self.api_url = api_url.rstrip('/')
+        self.bulk_data = bulk_data
+        self.bulk_data_type = bulk_data_type
+        self.bulk_data_url = bulk_data_url
+        self.card_index = CardIndex(card_index) if card_index else None
+        self.response_cache = None
+        if response_cache:
+            self.response_cache = ResponseCache(response_cache, response_cache_size, response_ttls)
+        self.compact_history = compact_history
+        self.downsample_history_after = downsample_history_after
+        self.rate_limiter = RateLimiter(request_interval)
+        self.session = None
+        self.foil_style = None
+
+    def __request(self, method, endpoint, **kwargs):
+        if self.response_cache and (response := self.response_cache.get(method, endpoint, kwargs)) is not None:
+            return response
+
+        session = self.__session()
+        with profile.phase('rate_limit'):
+            self.rate_limiter.wait()
+        profile.count('http_requests')
+        with profile.phase('http'):
+            start = time.monotonic()
+            response = session.request(method, f"{self.api_url}/{endpoint}", **kwargs).json()
+        if self.response_cache and response.get('object') != 'error':
+            self.response_cache.put(method, endpoint, kwargs, response, time.monotonic() - start)
+        return response
+
+    def __session(self):
+        if self.session is None:
+            import requests  # Only commands talking to Scryfall pay for importing requests.
+            self.session = requests.Session()
+            self.session.headers.update({'User-Agent': 'bookshelf', 'Accept': 'application/json'})
+        return self.session
+
+    def fetch_bulk_data(self, force=False):
+        """ Download the bulk data file price_update reads, returns False when the one on disk is still current.
+
+        The download is looked up by bulk_data_type unless bulk_data_url points at the file directly.
+        """
+        session = self.__session()
+        url, updated_at = self.bulk_data_url, None
+        if url is None:
+            with profile.phase('rate_limit'):
+                self.rate_limiter.wait()
+            profile.count('http_requests')
+            with profile.phase('http'):
+                response = session.get(f"{self.api_url}/bulk-data/{self.bulk_data_type}", timeout=TIMEOUT)
+            response.raise_for_status()
+            bulk_info = response.json()
+            url, updated_at = bulk_info['download_uri'], bulk_info.get('updated_at')
+        return BulkData(self.bulk_data).fetch(session, url, updated_at, force)
+
+    def bulk_data_snapshot(self):
+        return BulkData(self.bulk_data).snapshot()
 
     def get_price(self, sf_card_data, finish=None):
         prices = sf_card_data.get('prices', {})
@@ -47,56 +181,130 @@ class PluginMTG(PluginBase):
     def get_entry_info(self, entry=None, cardset=None, finish=None, price=None):
         card_info = None
         if entry:
-            search_request_param = {
-                'exact': entry
-            }
-            search_request = requests.get("https://api.scryfall.com/cards/named", search_request_param).json()
+            if oracle_id := self.card_index and self.card_index.oracle_id(entry):
+                try:
+                    card_info = self.__select_printing(self.card_index.printings(oracle_id), cardset)
+                except AmbiguousEntry:
+                    pass  # The index may predate the printing asked for, let the api decide.
 
-            if oracle_id := search_request.get('oracle_id'):
-                card_info = self.__get_card_info(oracle_id, cardset, finish)
+            if not card_info:
+                search_request = self.__request('GET', "cards/named", params={'exact': entry})
+                if oracle_id := search_request.get('oracle_id'):
+                    card_info_params = {
+                        'order': 'released',
+                        'unique': 'prints',
+                        'q': f'oracle_id:{oracle_id}',
+                    }
+                    printings = self.__request('GET', "cards/search", params=card_info_params)['data']
+                    card_info = self.__select_printing(printings, cardset)
         elif cardset:
             setcode, cardnum = cardset.split("#")
-            card_info = requests.get(f"https://api.scryfall.com/cards/{setcode}/{cardnum}/en").json()
+            if not (card_info := self.card_index and self.card_index.card(setcode, cardnum)):
+                card_info = self.__request('GET', f"cards/{setcode}/{cardnum}/en")
 
         if card_info and not card_info.get('object') == "error":
-            price_history = []
+            return self.__make_entry(card_info, finish, price)
+        else:
+            raise NoEntryFound
+
+    def get_entries_info(self, entry_requests):
+        """ Resolve many entries at once, in order, giving either the entry info or the error for each.
 
-            if price or (price := self.get_price(card_info, finish)):
-                price_history.append({'date': self.get_timestamp(), 'price': price, 'currency': 'eur'})
+        Entries pinned to an exact SET#CollectorNumber are fetched in batches from /cards/collection,
+        anything else falls back to get_entry_info.
+        """
+        results = [None] * len(entry_requests)
+        exact = {}
+        for pos, entry_request in enumerate(entry_requests):
+            cardset = entry_request.get('cardset')
+            if cardset and '#' in cardset:
+                setcode, cardnum = cardset.lower().split("#")
+                if local_card := self.card_index and self.card_index.card(setcode, cardnum):
+                    results[pos] = self.__try_make_entry(local_card, entry_request)
+                else:
+                    exact.setdefault((setcode, cardnum), []).append(pos)
             else:
-                raise NoPriceFoundError
-
-            mtg_dict = {
-                'bookshelf_type': 'mtg',
-                'version': self.version,
-                'name': card_info.get('name'),
-                'oracle_id': card_info.get('oracle_id'),
-                'scryfall_id': card_info.get('id'),
-                'set': card_info.get('set'),
-                'collector_number': card_info.get('collector_number'),
-                'finish': finish,
-                'price_history': price_history,
-            }
-
-            return mtg_dict
+                results[pos] = self.__try_entry_info(entry_request)
+
+        identifiers = [{'set': setcode, 'collector_number': cardnum} for setcode, cardnum in exact]
+        for batch_start in range(0, len(identifiers), self.collection_batch_size):
+            batch = identifiers[batch_start:batch_start + self.collection_batch_size]
+            response = self.__request('POST', "cards/collection", json={'identifiers': batch})
+            for card_info in response.get('data', []):
+                for pos in exact.pop((card_info['set'].lower(), card_info['collector_number'].lower()), []):
+                    results[pos] = self.__try_make_entry(card_info, entry_requests[pos])
+
+        for positions in exact.values():
+            for pos in positions:
+                results[pos] = NoEntryFound()
+        return results
+
+    def __try_make_entry(self, card_info, entry_request):
+        try:
+            return self.__make_entry(card_info, entry_request.get('finish'), entry_request.get('price'))
+        except NoPriceFoundError as e:
+            return e
+
+    def __try_entry_info(self, entry_request):
+        try:
+            return self.get_entry_info(entry_request.get('entry'), entry_request.get('cardset'),
+                                       entry_request.get('finish'), entry_request.get('price'))
+        except (NoPriceFoundError, NoEntryFound, AmbiguousEntry) as e:
+            return e
+
+    def read_entry_list(self, list_path):
+        """ Parse a decklist into entry requests, one per line as in "4 Lightning Bolt (2XM) 129 *F*". """
+        entry_requests = []
+        with open(list_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if not (match := ENTRY_LIST_LINE.match(line)):
+                    raise NoEntryFound(line)
+
+                cardset = match['set'] and match['set'].lower()
+                if cardset and match['collector_number']:
+                    cardset += f"#{match['collector_number']}"
+                entry_requests.append({
+                    'times': int(match['times'] or 1),
+                    'entry': match['name'],
+                    'cardset': cardset,
+                    'finish': ENTRY_LIST_FINISHES.get(match['finish']),
+                })
+        return entry_requests
+
+    def __make_entry(self, card_info, finish=None, price=None):
+        price_history = []
+
+        if price or (price := self.get_price(card_info, finish)):
+            price_history.append({'date': self.get_timestamp(), 'price': price, 'currency': 'eur'})
         else:
-            raise NoEntryFound
+            raise NoPriceFoundError
 
-    def __get_card_info(self, oracle_id, cardset, finish):
-        card_info_params = {
-            'order': 'released',
-            'unique': 'prints',
-            'q': f'oracle_id:{oracle_id}',
+        mtg_dict = {
+            'bookshelf_type': 'mtg',
+            'version': self.version,
+            'name': card_info.get('name'),
+            'oracle_id': card_info.get('oracle_id'),
+            'scryfall_id': card_info.get('id'),
+            'set': card_info.get('set'),
+            'collector_number': card_info.get('collector_number'),
+            'finish': finish,
+            'price': price,
+            'price_history': price_history,
         }
-        cards_info = requests.get("https://api.scryfall.com/cards/search", card_info_params).json()
 
+        return mtg_dict
+
+    def __select_printing(self, printings, cardset):
         data_pos = None
         if cardset == '*':
             data_pos = 0
         else:
             card_sets = []
             found_pos = []
-            for pos, card_data in enumerate(cards_info['data']):
+            for pos, card_data in enumerate(printings):
                 sf_card_set = f"{card_data['set']}#{card_data['collector_number']}"
                 if cardset and cardset == sf_card_set:
                     return card_data
@@ -106,17 +314,22 @@ class PluginMTG(PluginBase):
 
             # if no match or too many matches.
             if not found_pos or len(found_pos) > 1:
-                print([card_sets[i] for i in found_pos] if found_pos else card_sets)
-                sys.exit(0)
+                raise AmbiguousEntry([card_sets[i] for i in found_pos] if found_pos else card_sets)
 
             data_pos = found_pos[0]
-        return cards_info['data'][data_pos]
+        return printings[data_pos]
+
+    def build_card_index(self):
+        """ Build the offline card index from the bulk data file, returns number of cards indexed. """
+        with open(self.bulk_data, "r") as f, profile.phase('bulk_scan'):
+            return self.card_index.build(iter_json_array(f))
 
     def metadata_stringify(self, metadata_json, only_title=False, multiples=1):
         if only_title:
             return metadata_json['name']
 
-        price = metadata_json['price_history'][-1]['price']
+        if (price := metadata_json.get('price')) is None:
+            price = metadata_json['price_history'][-1]['price']
         metadata_str = ""
         if multiples is not None:
             metadata_str = f"{multiples}x "
@@ -129,12 +342,27 @@ class PluginMTG(PluginBase):
         metadata_str += f" [€{price}]"
         return metadata_str
 
+    def metadata_row(self, metadata_json):
+        return {
+            'name': metadata_json['name'],
+            'set': metadata_json['set'],
+            'collector_number': metadata_json['collector_number'],
+            'finish': metadata_json.get('finish'),
+            'price': current_price(metadata_json),
+            'currency': self.currency,
+        }
+
     def __foil_color(self, text):
-        foil_color = getattr(pycolors, self.foil_color)
-        return foil_color(text)
+        if self.foil_style is None:
+            import colors as pycolors
+            self.foil_style = getattr(pycolors, self.foil_color)
+        return self.foil_style(text)
 
     def print_metadata(self, metadata_json, only_title=False, multiples=1):
-        print(self.metadata_stringify(metadata_json, only_title, multiples))
+        with profile.phase('format'):
+            metadata_str = self.metadata_stringify(metadata_json, only_title, multiples)
+        with profile.phase('output'):
+            print(metadata_str)
 
     def get_unique_id(self, metadata_json, edition=True):
         if edition:
@@ -149,23 +377,32 @@ class PluginMTG(PluginBase):
         return metadata_json.get('name')
 
     def price_update(self, collection):
-        json_data_path = Path("resources/cards.json")
+        """ Append the bulk data price of every owned card to its price history, unless it is still the same.
+
+        Cards without a price in the bulk data are left untouched.
+        """
+        json_data_path = Path(self.bulk_data)
         print(f"Trying to load: {json_data_path.resolve()}")
 
-        print("Load new prices...")
-        with open(json_data_path, "r") as f:
-            scryfall_data = json.load(f)
+        # Collection is keyed by unique id which includes finish, bulk data is keyed by scryfall id only.
+        owned_cards = {}
+        for entries in collection.values():
+            for card_path, card_info in entries:
+                owned_cards.setdefault(card_info['scryfall_id'], []).append(card_info)
 
         print("Find updates")
-        for sf_entry in scryfall_data:
-            sf_id = sf_entry.get('id')
-
-            if entries := collection.get(sf_id):
-                for card_path, card_info in entries:
-                    new_price = self.get_price(sf_entry, finish=card_info['finish'])
-                    new_price_entry = {
-                        'date': self.get_timestamp(),
-                        'price': new_price,
-                        'currency': self.currency
-                    }
-                    card_info['price_history'].append(new_price_entry)
+        scanned = 0
+        with open(json_data_path, "r") as f, profile.phase('bulk_scan'):
+            for scanned, sf_entry in enumerate(iter_json_array(f), start=1):
+                if entries := owned_cards.get(sf_entry.get('id')):
+                    for card_info in entries:
+                        new_price = self.get_price(sf_entry, finish=card_info.get('finish'))
+                        if new_price is None or new_price == current_price(card_info):
+                            continue
+                        new_price_entry = {
+                            'date': self.get_timestamp(),
+                            'price': new_price,
+                            'currency': self.currency
+                        }
+                        self.append_price(card_info, new_price_entry)
+        profile.count('bulk_entries', scanned)